@@ -9,10 +9,20 @@ from flask_bootstrap import Bootstrap
 from flask_moment import Moment
 from flask_migrate import Migrate # git for db
 from flask_login import LoginManager
+from werkzeug.middleware.proxy_fix import ProxyFix
 
 from handlers import blueprint_list
 from configs import configs
 from models import db, Role, User
+from query_guard import QueryGuard
+from last_seen import LastSeenTracker
+from rendering import init_rendering
+from commands import register_commands
+from email_app import MailWorkerPool
+from identity_cache import user_cache, load_user
+from page_cache import page_cache
+from metrics import Metrics
+from ratelimit import RateLimiter
 
 
 def register_blueprints(app):
@@ -27,12 +37,21 @@ def register_extensions(app):
     login_manager = LoginManager()    # 从这一行开始为新增代码
     login_manager.init_app(app)
     PageDown().init_app(app)
+    QueryGuard(app)
+    LastSeenTracker(app)
+    init_rendering(app)
+    MailWorkerPool(app)
+    page_cache.init_app(app)
+    Metrics(app)
+    RateLimiter(app)
+
+    user_cache.init_app(app)
 
     # 该方法会被动执行，查找用户将其设为已登录状态
     @login_manager.user_loader
     def user_loader(id):
-        # 只有主键才可以使用 query.get 方法查询
-        return User.query.get(id)
+        # 先读取内存中的缓存，未命中时才使用 query.get 方法查询
+        return load_user(id)
 
     # 未登录状态下访问需要登录后才能访问的页面时，自动跳转到此路由
     login_manager.login_view = 'front.login'
@@ -43,7 +62,12 @@ def register_extensions(app):
 def create_app(config):
     app = Flask(__name__)
     app.config.from_object(configs.get(config)) # add configs from the 'configs' file
+    proxies = app.config.get('TRUSTED_PROXIES', 0)
+    if proxies:
+        # 只信任最后 proxies 层代理添加的地址，客户端伪造的 X-Forwarded-For 无效
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=proxies, x_proto=proxies)
     register_extensions(app)
     register_blueprints(app)
+    register_commands(app)
 
     return app
@@ -0,0 +1,90 @@
+'''
+冷热数据分离：把旧博客和它们的评论移入 blog_archive 和 comment_archive 数据表
+
+由 flask archive-blogs 命令分批执行，每批博客在一个事务中完成：
+复制到归档表，删除原数据表中的博客、评论、时间线和搜索索引。
+blog 和 comment 数据表及其索引只保留较新的数据，首页等列表查询更快。
+博客页面和个人主页在原数据表中找不到时读取归档表，归档的博客和评论只读，
+也不会出现在搜索结果和关注动态中。
+'''
+from datetime import datetime
+
+from sqlalchemy import literal, DateTime
+
+from models import db, Blog, Comment, Timeline, ArchivedBlog, ArchivedComment
+from page_cache import page_cache
+import search
+
+BLOG_COLUMNS = ('id', 'body', 'body_html', 'time_stamp', 'updated_at',
+                'author_id')
+COMMENT_COLUMNS = ('id', 'body', 'time_stamp', 'updated_at', 'disable',
+                   'author_id', 'blog_id')
+
+
+def copy_rows(source, target, columns, condition, now):
+    '''INSERT INTO target SELECT ... FROM source WHERE condition'''
+    select = db.select([source.c[name] for name in columns] +
+                       [literal(now, DateTime)]).where(condition)
+    db.session.execute(target.insert().from_select(
+        list(columns) + ['archived_at'], select))
+
+
+def archive_batch(rows):
+    '''归档一批博客，rows 为 (id, author_id) 列表'''
+    ids = [row.id for row in rows]
+    blogs = Blog.__table__
+    comments = Comment.__table__
+    now = datetime.now()
+    copy_rows(blogs, ArchivedBlog.__table__, BLOG_COLUMNS,
+              blogs.c.id.in_(ids), now)
+    copy_rows(comments, ArchivedComment.__table__, COMMENT_COLUMNS,
+              comments.c.blog_id.in_(ids), now)
+    search.remove_documents('b', ids)
+    search.remove_documents('c', db.select([comments.c.id])
+                            .where(comments.c.blog_id.in_(ids)))
+    # 批量删除不会触发映射类的事件，作者的博客数保持不变
+    db.session.execute(comments.delete().where(comments.c.blog_id.in_(ids)))
+    db.session.execute(Timeline.__table__.delete()
+                       .where(Timeline.__table__.c.blog_id.in_(ids)))
+    db.session.execute(blogs.delete().where(blogs.c.id.in_(ids)))
+    db.session.commit()
+    page_cache.invalidate('blogs', *(['blog:{}'.format(id) for id in ids] +
+                                     ['user:{}'.format(row.author_id)
+                                      for row in rows]))
+
+
+def archive_blogs(cutoff, batch_size):
+    '''归档发布时间早于 cutoff 的博客，每批完成后返回本批的数量'''
+    # 不归档 id 最大的博客，以免 SQLite 等数据库重新使用已归档的 id
+    max_id = db.session.query(db.func.max(Blog.id)).scalar()
+    if max_id is None:
+        return
+    while True:
+        rows = (db.session.query(Blog.id, Blog.author_id)
+                .filter(Blog.time_stamp < cutoff, Blog.id < max_id)
+                .order_by(Blog.id).limit(batch_size).all())
+        if not rows:
+            return
+        archive_batch(rows)
+        yield len(rows)
+
+
+def get_blog(id):
+    '''按 id 查找博客，先查 blog 数据表，找不到时查归档表'''
+    return (Blog.with_authors(Blog.query).filter_by(id=id).first() or
+            ArchivedBlog.with_authors(ArchivedBlog.query)
+            .filter_by(id=id).first())
+
+
+def comments_of(blog):
+    '''返回博客评论的查询和分页使用的列'''
+    model = ArchivedComment if blog.archived else Comment
+    query = model.with_authors(model.query.filter(model.blog_id == blog.id))
+    return query, (model.time_stamp, model.id)
+
+
+def archived_blogs_of(user):
+    '''个人主页合并分页时使用的归档表查询和列'''
+    query = ArchivedBlog.with_authors(
+        ArchivedBlog.query.filter(ArchivedBlog.author_id == user.id))
+    return query, (ArchivedBlog.time_stamp, ArchivedBlog.id)
@@ -0,0 +1,21 @@
+'''
+以 ASGI 方式运行应用，需要额外安装 asgiref 和一个 ASGI 服务器：
+
+    pip install asgiref uvicorn
+    uvicorn asgi:application --workers 4
+
+这里只是一个兼容层，让应用可以部署在只支持 ASGI 的服务器上，不能减少线程的占用：
+WsgiToAsgi 在线程池中运行整个 WSGI 应用，从读取请求到响应全部发送给客户端
+都占用同一个线程，慢速客户端（例如移动网络下的 JSON 接口调用）一样会占住线程，
+线程池满了以后新请求只能排队。
+要让慢速客户端不占用线程，需要用真正的异步处理函数提供 /api/v1 接口，
+不能靠这个包装。
+'''
+from dotenv import load_dotenv
+load_dotenv(override=True)
+
+from asgiref.wsgi import WsgiToAsgi
+
+from app import create_app
+
+application = WsgiToAsgi(create_app('dev'))
@@ -0,0 +1,8 @@
+'''
+性能测试：用 PerfConfig 创建应用，生成测试数据，压测主要的页面
+
+    python -m benchmarks.run --users 1000 --blogs 5000 --requests 200
+    python -m benchmarks.run --save-baseline    # 保存为基准
+    python -m benchmarks.run --wsgi             # 通过本地 WSGI 服务器压测
+    python -m benchmarks.query_plans            # 检查热点查询的执行计划
+'''
@@ -0,0 +1,148 @@
+'''
+检查热点查询的执行计划：生成测试数据后对每个查询执行 EXPLAIN ，
+出现全表扫描或额外排序（filesort / 临时 B 树）时返回非 0
+
+    python -m benchmarks.query_plans --users 500 --blogs 5000
+    python -m benchmarks.query_plans --no-seed    # 使用已有的数据库
+
+支持 SQLite 和 MySQL ，数据库由 PerfConfig 的 PERF_DATABASE_URI 指定
+'''
+import argparse
+import re
+import sys
+
+from sqlalchemy import func
+
+from app import create_app
+from models import db, User, Blog, Comment, Follow, Timeline
+from pagination import keyset_query
+from benchmarks.seed import seed
+
+# SQLite 的 EXPLAIN QUERY PLAN 中没有使用索引的扫描，例如 'SCAN blog'
+SQLITE_FULL_SCAN = re.compile(r'^SCAN (TABLE )?\w+$')
+# 按索引顺序扫描，例如 'SCAN blog USING INDEX ix_blog_time'
+SQLITE_INDEX_SCAN = re.compile(r'^SCAN (TABLE )?\w+ USING ')
+
+
+def middle(query, columns):
+    '''取查询结果中间的一行作为翻页游标的位置'''
+    count = query.order_by(None).count()
+    row = (keyset_query(query, columns, None)
+           .offset(count // 2).first())
+    if row is not None:
+        return ('n',) + tuple(getattr(row, column.key) for column in columns)
+
+
+def hot_queries(per_page=10):
+    '''
+    返回 [(名称, 查询, 是否允许按索引顺序扫描)]，与视图函数中的分页查询相同
+    只有不带过滤条件的首页可以按索引顺序扫描，读到 LIMIT 条就停止；
+    带过滤条件的查询按索引顺序扫描时，可能要读完整个索引才能凑够一页
+    '''
+    # 粉丝最多、博客最多、评论最多的用户和博客最能暴露问题
+    star = User.query.order_by(User.followers_count.desc()).first()
+    writer = User.query.order_by(User.blogs_count.desc()).first()
+    fan = User.query.order_by(User.followed_count.desc()).first()
+    blog_id = (db.session.query(Comment.blog_id).group_by(Comment.blog_id)
+               .order_by(func.count().desc()).limit(1).scalar())
+    blog = Blog.query.get(blog_id)
+
+    listings = [
+        ('index', Blog.with_authors(Blog.query), (Blog.time_stamp, Blog.id),
+         True),
+        ('profile', Blog.with_authors(writer.blogs), (Blog.time_stamp, Blog.id),
+         False),
+        ('comments', Comment.with_authors(blog.comments),
+         (Comment.time_stamp, Comment.id), False),
+        ('followed', fan.followed, (Follow.time_stamp, Follow.followed_id),
+         False),
+        ('followers', star.followers, (Follow.time_stamp, Follow.follower_id),
+         False),
+    ]
+    queries = []
+    for name, query, columns, scan_ok in listings:
+        queries.append((name, keyset_query(query, columns, None)
+                        .limit(per_page + 1), scan_ok))
+        position = middle(query, columns)
+        if position is not None:
+            queries.append((name + ' (next page)', keyset_query(
+                query, columns, position).limit(per_page + 1), scan_ok))
+    queries.append(('feed', Blog.with_authors(Blog.query)
+                    .join(Timeline, Timeline.blog_id == Blog.id)
+                    .filter(Timeline.user_id == fan.id)
+                    .order_by(Timeline.time_stamp.desc()).limit(per_page),
+                    False))
+    return queries
+
+
+def explain(query, scan_ok=False):
+    '''执行 EXPLAIN ，返回 (执行计划的每一行, 发现的问题列表)'''
+    dialect = db.engine.dialect
+    compiled = query.statement.compile(dialect=dialect)
+    params = compiled.params
+    if compiled.positional:
+        params = [params[name] for name in compiled.positiontup]
+    prefix = 'EXPLAIN QUERY PLAN ' if dialect.name == 'sqlite' else 'EXPLAIN '
+    cursor = db.session.connection().connection.cursor()
+    cursor.execute(prefix + str(compiled), params)
+    columns = [d[0] for d in cursor.description]
+    rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+    cursor.close()
+
+    problems = []
+    if dialect.name == 'sqlite':
+        lines = [row['detail'] for row in rows]
+        for line in lines:
+            if SQLITE_FULL_SCAN.match(line):
+                problems.append('full scan: ' + line)
+            elif SQLITE_INDEX_SCAN.match(line) and not scan_ok:
+                problems.append('full index scan: ' + line)
+            elif 'TEMP B-TREE' in line:
+                problems.append('filesort: ' + line)
+    else:
+        lines = ['{table} type={type} key={key} {Extra}'.format(**row)
+                 for row in rows]
+        for row, line in zip(rows, lines):
+            if row['type'] == 'ALL':
+                problems.append('full scan: ' + line)
+            elif row['type'] == 'index' and not scan_ok:
+                problems.append('full index scan: ' + line)
+            if 'filesort' in (row['Extra'] or ''):
+                problems.append('filesort: ' + line)
+    return lines, problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='检查热点查询的执行计划')
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--follows', type=int, default=20,
+                        help='每个用户平均关注的人数')
+    parser.add_argument('--blogs', type=int, default=5000)
+    parser.add_argument('--comments', type=int, default=20000)
+    parser.add_argument('--no-seed', action='store_true',
+                        help='不重新生成数据，直接检查现有的数据库')
+    args = parser.parse_args(argv)
+
+    app = create_app('perf')
+    with app.app_context():
+        if db.engine.dialect.name not in ('sqlite', 'mysql'):
+            print('不支持的数据库：', db.engine.dialect.name)
+            return 2
+        if not args.no_seed:
+            seed(args.users, args.follows, args.blogs, args.comments)
+        failed = []
+        for name, query, scan_ok in hot_queries():
+            lines, problems = explain(query, scan_ok)
+            print('{} {}'.format('FAIL' if problems else 'ok  ', name))
+            for line in lines:
+                print('      ' + line)
+            if problems:
+                failed.append(name)
+    if failed:
+        print('执行计划退化：', ', '.join(failed))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,213 @@
+'''
+压测主要的页面，报告每个页面的 p50/p95/p99 延迟、吞吐量和平均 SQL 语句数，
+并与保存的基准结果比较
+'''
+import argparse
+import http.client
+import json
+import os
+import random
+import sys
+import threading
+import time
+from http.cookies import SimpleCookie
+from urllib.parse import urlencode
+
+sys.path.append('.')
+
+from sqlalchemy import event
+from werkzeug.serving import make_server, WSGIRequestHandler
+
+from app import create_app
+from models import db, User
+from benchmarks.seed import seed, PASSWORD
+
+BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+
+class QueryCounter:
+    '''统计数据库引擎执行的 SQL 语句数量'''
+
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine, 'before_cursor_execute', self.on_execute)
+
+    def on_execute(self, *args):
+        self.count += 1
+
+
+class TestClientDriver:
+    '''通过 Flask 的测试客户端发送请求'''
+
+    def __init__(self, app):
+        self.app = app
+
+    def session(self):
+        return self.app.test_client()
+
+    @staticmethod
+    def request(client, method, path, data=None):
+        return client.open(path, method=method, data=data).status_code
+
+
+class QuietHandler(WSGIRequestHandler):
+    '''不打印每个请求的访问日志'''
+
+    def log_request(self, *args, **kw):
+        pass
+
+
+class WSGIDriver:
+    '''通过本地 WSGI 服务器发送真实的 HTTP 请求'''
+
+    def __init__(self, app):
+        self.server = make_server('127.0.0.1', 0, app, threaded=True,
+                                  request_handler=QuietHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def session(self):
+        return {'cookies': SimpleCookie()}
+
+    def request(self, client, method, path, data=None):
+        conn = http.client.HTTPConnection('127.0.0.1', self.server.server_port)
+        headers = {'Cookie': '; '.join('{}={}'.format(k, v.value)
+                                       for k, v in client['cookies'].items())}
+        body = None
+        if data is not None:
+            body = urlencode(data)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        conn.request(method, path, body=body, headers=headers)
+        response = conn.getresponse()
+        response.read()
+        for header in response.headers.get_all('Set-Cookie') or ():
+            client['cookies'].load(header)
+        conn.close()
+        return response.status
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def login(driver, user_id):
+    client = driver.session()
+    driver.request(client, 'POST', '/login', {
+        'email': 'user{}@example.com'.format(user_id), 'password': PASSWORD})
+    return client
+
+
+def scenarios(driver, stats, rng):
+    '''每个场景返回 (页面名, 生成一次请求参数的函数)'''
+    users, blogs = stats['users'], stats['blogs']
+    anonymous = driver.session()
+    member = login(driver, 1)
+    return [
+        ('front.index (anonymous)', lambda: (anonymous, 'GET', '/', None)),
+        ('front.index', lambda: (member, 'GET', '/', None)),
+        ('front.blog', lambda: (member, 'GET', '/blog/{}'.format(
+            rng.randint(1, blogs)), None)),
+        ('user.index', lambda: (member, 'GET', '/user/user{}/index'.format(
+            rng.randint(1, users)), None)),
+        # 排名靠前的用户粉丝最多
+        ('user.followers', lambda: (member, 'GET', '/user/user{}/followers'.format(
+            rng.randint(1, 10)), None)),
+        ('front.login', lambda: (driver.session(), 'POST', '/login', {
+            'email': 'user{}@example.com'.format(rng.randint(1, users)),
+            'password': PASSWORD})),
+        ('front.index (publish)', lambda: (member, 'POST', '/', {
+            'body': 'benchmark post {}'.format(rng.random())})),
+    ]
+
+
+def run(app, driver, stats, requests, rng):
+    counter = QueryCounter(db.get_engine(app))
+    results = {}
+    for name, make_request in scenarios(driver, stats, rng):
+        latencies = []
+        queries = 0
+        start = time.perf_counter()
+        for _ in range(requests):
+            client, method, path, data = make_request()
+            before = counter.count
+            began = time.perf_counter()
+            status = driver.request(client, method, path, data)
+            latencies.append(time.perf_counter() - began)
+            queries += counter.count - before
+            if status >= 400:
+                raise RuntimeError('{} {} 返回 {}'.format(method, path, status))
+        elapsed = time.perf_counter() - start
+        results[name] = {
+            'p50': percentile(latencies, 50) * 1000,
+            'p95': percentile(latencies, 95) * 1000,
+            'p99': percentile(latencies, 99) * 1000,
+            'rps': requests / elapsed,
+            'queries': queries / requests,
+        }
+    return results
+
+
+def report(results, baseline, tolerance):
+    '''打印结果，返回比基准慢了超过 tolerance 的页面'''
+    regressions = []
+    print('{:<26}{:>9}{:>9}{:>9}{:>9}{:>9}'.format(
+        'endpoint', 'p50 ms', 'p95 ms', 'p99 ms', 'req/s', 'queries'))
+    for name, r in results.items():
+        line = '{:<26}{:>9.2f}{:>9.2f}{:>9.2f}{:>9.1f}{:>9.1f}'.format(
+            name, r['p50'], r['p95'], r['p99'], r['rps'], r['queries'])
+        base = baseline.get(name)
+        if base:
+            change = (r['p95'] - base['p95']) / base['p95'] if base['p95'] else 0
+            line += '   p95 {:+.0%}  queries {:+.1f}'.format(
+                change, r['queries'] - base['queries'])
+            # 语句数量是多次请求的平均值，多出半条以上才算退化
+            if change > tolerance or r['queries'] > base['queries'] + 0.5:
+                regressions.append(name)
+        print(line)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='flaska 性能测试')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--follows', type=int, default=20,
+                        help='每个用户平均关注的人数')
+    parser.add_argument('--blogs', type=int, default=5000)
+    parser.add_argument('--comments', type=int, default=20000)
+    parser.add_argument('--requests', type=int, default=200,
+                        help='每个页面的请求次数')
+    parser.add_argument('--wsgi', action='store_true',
+                        help='通过本地 WSGI 服务器而不是测试客户端发送请求')
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='p95 延迟比基准慢多少算退化')
+    args = parser.parse_args(argv)
+
+    app = create_app('perf')
+    rng = random.Random(0)
+    with app.app_context():
+        began = time.perf_counter()
+        stats = seed(args.users, args.follows, args.blogs, args.comments)
+        print('生成数据 {}，用时 {:.1f} 秒'.format(
+            stats, time.perf_counter() - began))
+    driver = WSGIDriver(app) if args.wsgi else TestClientDriver(app)
+    results = run(app, driver, stats, args.requests, rng)
+
+    baseline = {}
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    regressions = report(results, baseline, args.tolerance)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print('基准已保存到', args.baseline)
+    elif regressions:
+        print('性能退化：', ', '.join(regressions))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
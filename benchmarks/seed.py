@@ -0,0 +1,80 @@
+'''
+批量生成测试数据：用户、关注关系（被关注数呈幂律分布）、博客和评论
+所有数据用 Core 的 executemany 批量写入，不逐条经过 ORM
+'''
+import random
+from bisect import bisect
+from datetime import datetime, timedelta
+from itertools import accumulate
+
+from models import db, Role, User, Follow, Blog, Comment, Timeline
+from passwords import hasher
+from rendering import render_markdown
+
+PASSWORD = 'benchmark'
+WORDS = ('flask python 数据库 博客 缓存 性能 测试 markdown 查询 索引 '
+         'hello world 你好 世界 web server 分页 评论 关注').split()
+
+
+def paragraph(rng, words):
+    return ' '.join(rng.choice(WORDS) for _ in range(words))
+
+
+def insert(table, rows, chunk=1000):
+    for i in range(0, len(rows), chunk):
+        db.session.execute(table.insert(), rows[i:i + chunk])
+
+
+def seed(users=1000, follows=20, blogs=5000, comments=20000,
+         alpha=1.2, random_seed=42):
+    '''
+    生成测试数据，需要在应用上下文中调用
+    follows 为每个用户平均关注的人数，被关注的概率与排名的 alpha 次方成反比
+    '''
+    rng = random.Random(random_seed)
+    db.drop_all()
+    db.create_all()
+    Role.insert_roles()
+    role_id = Role.default_id()
+    # 所有用户使用同一个密码，只计算一次哈希
+    password = hasher.hash(PASSWORD)
+    now = datetime.now()
+    insert(User.__table__, [dict(
+        id=i, name='user{}'.format(i), email='user{}@example.com'.format(i),
+        password=password, confirmed=True, role_id=role_id,
+        create_at=now, last_seen=now) for i in range(1, users + 1)])
+
+    # 排名越靠前的用户越容易被关注
+    weights = list(accumulate(1 / rank ** alpha for rank in range(1, users + 1)))
+    edges = set()
+    for follower in range(1, users + 1):
+        for _ in range(rng.randint(0, follows * 2)):
+            followed = bisect(weights, rng.random() * weights[-1]) + 1
+            if followed != follower:
+                edges.add((follower, followed))
+    insert(Follow.__table__, [dict(follower_id=a, followed_id=b, time_stamp=now)
+                              for a, b in edges])
+
+    # 博客作者也按幂律分布，正文只有少数几种，渲染结果可以复用
+    bodies = [paragraph(rng, rng.randint(20, 200)) for _ in range(50)]
+    rows = []
+    for i in range(1, blogs + 1):
+        body = rng.choice(bodies)
+        time_stamp = now - timedelta(minutes=blogs - i)
+        rows.append(dict(id=i, body=body, body_html=render_markdown(body),
+                         time_stamp=time_stamp, updated_at=time_stamp,
+                         author_id=bisect(weights, rng.random() * weights[-1]) + 1))
+    insert(Blog.__table__, rows)
+
+    insert(Comment.__table__, [dict(
+        id=i, body=paragraph(rng, rng.randint(3, 30)), disable=False,
+        time_stamp=now - timedelta(seconds=comments - i),
+        updated_at=now, author_id=rng.randint(1, users),
+        blog_id=rng.randint(1, blogs)) for i in range(1, comments + 1)])
+
+    db.session.commit()
+    # 先计算计数列并标记热门作者，时间线与应用中一样不包含热门作者的博客
+    User.reconcile_counters()
+    Timeline.rebuild()
+    return {'users': users, 'follows': len(edges), 'blogs': blogs,
+            'comments': comments}
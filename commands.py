@@ -0,0 +1,197 @@
+'''
+flask 命令行工具，在 create_app 中注册
+
+例如：flask rerender-blogs --batch-size 500 --workers 4
+'''
+import os
+import time
+from datetime import datetime, timedelta
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+
+import click
+
+from models import db, Blog, Comment, User, SearchPosting
+from rendering import render_markdown
+from search import tokenize_rows
+from passwords import hasher
+import dataio
+import archive
+import suggestions
+
+
+def register_commands(app):
+
+    @app.cli.command('rerender-blogs')
+    @click.option('--batch-size', default=500, help='每批处理的博客数量')
+    @click.option('--workers', default=None, type=int,
+                  help='渲染进程数，默认为 CPU 核数')
+    def rerender_blogs(batch_size, workers):
+        '''允许的标签等清洗规则变化后，重新渲染所有博客的 body_html'''
+        total = 0
+        last_id = 0
+        with ProcessPoolExecutor(workers) as executor:
+            while True:
+                rows = (db.session.query(Blog.id, Blog.body)
+                        .filter(Blog.id > last_id).order_by(Blog.id)
+                        .limit(batch_size).all())
+                if not rows:
+                    break
+                bodies = [row.body or '' for row in rows]
+                htmls = executor.map(render_markdown, bodies,
+                                     chunksize=max(1, len(rows) // 32))
+                # bulk_update_mappings 不会触发 Blog.body 的监听程序
+                db.session.bulk_update_mappings(Blog, [
+                    {'id': row.id, 'body_html': html}
+                    for row, html in zip(rows, htmls)])
+                db.session.commit()
+                last_id = rows[-1].id
+                total += len(rows)
+                click.echo('已渲染 {} 篇博客'.format(total))
+
+    @app.cli.command('reconcile-counters')
+    def reconcile_counters():
+        '''重新统计所有用户的粉丝数、关注数和博客数'''
+        User.reconcile_counters()
+        click.echo('计数已更新')
+
+    @app.cli.command('rebuild-search-index')
+    @click.option('--batch-size', default=500, help='每批处理的文档数量')
+    @click.option('--workers', default=None, type=int,
+                  help='分词进程数，默认为 CPU 核数')
+    def rebuild_search_index(batch_size, workers):
+        '''清空并重建博客和评论的全文搜索索引'''
+        SearchPosting.query.delete()
+        db.session.commit()
+        table = SearchPosting.__table__
+        with ProcessPoolExecutor(workers) as executor:
+            for model, doc_type in ((Blog, 'b'), (Comment, 'c')):
+                batches = iter_batches(model, batch_size)
+                rows = (
+                    [(doc_type, row.id, row.body) for row in batch]
+                    for batch in batches)
+                total = 0
+                # 多个进程同时分词，主进程按顺序写入
+                for result in ordered_map(executor, tokenize_rows, rows):
+                    if result:
+                        db.session.execute(table.insert(), result)
+                        db.session.commit()
+                    total += 1
+                click.echo('{}：已索引 {} 批'.format(model.__tablename__, total))
+
+    @app.cli.command('bench-password')
+    @click.option('--seconds', default=5.0, help='测试持续的秒数')
+    def bench_password(seconds):
+        '''测试当前配置下每秒能计算多少个密码哈希'''
+        workers = app.config['PASSWORD_HASH_WORKERS']
+        cores = 1 if workers == 0 else workers or os.cpu_count()
+
+        def hash_once(password):
+            # 线程中没有应用上下文，需要推送一个才能读取配置
+            with app.app_context():
+                return hasher.hash(password)
+
+        done = 0
+        start = time.perf_counter()
+        with ThreadPoolExecutor(cores) as executor:
+            while time.perf_counter() - start < seconds:
+                done += len(list(executor.map(
+                    hash_once, ['benchmark'] * cores * 4)))
+        elapsed = time.perf_counter() - start
+        click.echo('{}：{} 个进程，{:.1f} 个/秒，每核 {:.1f} 个/秒'.format(
+            app.config['PASSWORD_HASH_METHOD'], cores, done / elapsed,
+            done / elapsed / cores))
+
+    @app.cli.command('export-data')
+    @click.argument('directory', type=click.Path(file_okay=False))
+    @click.option('--format', 'fmt', type=click.Choice(dataio.FORMATS),
+                  default='jsonl', help='文件格式')
+    @click.option('--chunk-size', default=1000, help='每次从数据库读取的行数')
+    def export_data(directory, fmt, chunk_size):
+        '''把用户、关注、博客和评论导出到 DIRECTORY 目录'''
+        os.makedirs(directory, exist_ok=True)
+        for name, model, columns in dataio.TABLES:
+            total = dataio.export_table(name, model, columns, directory, fmt,
+                                        chunk_size)
+            click.echo('{}：已导出 {} 行'.format(name, total))
+
+    @app.cli.command('import-data')
+    @click.argument('directory', type=click.Path(exists=True, file_okay=False))
+    @click.option('--format', 'fmt', type=click.Choice(dataio.FORMATS),
+                  default='jsonl', help='文件格式')
+    @click.option('--chunk-size', default=1000, help='每次插入的行数')
+    @click.option('--workers', default=None, type=int,
+                  help='渲染和分词的进程数，默认为 CPU 核数')
+    def import_data(directory, fmt, chunk_size, workers):
+        '''
+        从 DIRECTORY 目录导入 export-data 导出的数据
+        导入的 id 保持不变，目标数据库中不能有相同 id 的数据
+        '''
+        with ProcessPoolExecutor(workers) as executor:
+            mapper = partial(ordered_map, executor)
+            for name, model, columns in dataio.TABLES:
+                path = os.path.join(directory, '{}.{}'.format(name, fmt))
+                if not os.path.exists(path):
+                    click.echo('{}：文件不存在，跳过'.format(name))
+                    continue
+                total = dataio.import_table(name, model, columns, path, fmt,
+                                            chunk_size, mapper)
+                click.echo('{}：已导入 {} 行'.format(name, total))
+        dataio.finish_import()
+        click.echo('计数和时间线已更新')
+
+    @app.cli.command('archive-blogs')
+    @click.option('--days', default=None, type=int,
+                  help='归档多少天以前的博客，默认为 ARCHIVE_AFTER_DAYS')
+    @click.option('--batch-size', default=None, type=int,
+                  help='每个事务归档的博客数量，默认为 ARCHIVE_BATCH_SIZE')
+    def archive_blogs(days, batch_size):
+        '''把旧博客和它们的评论移入归档表'''
+        days = days or app.config['ARCHIVE_AFTER_DAYS']
+        cutoff = datetime.now() - timedelta(days=days)
+        total = 0
+        for count in archive.archive_blogs(
+                cutoff, batch_size or app.config['ARCHIVE_BATCH_SIZE']):
+            total += count
+            click.echo('已归档 {} 篇博客'.format(total))
+        click.echo('{} 天以前的博客已全部归档'.format(days))
+
+    @app.cli.command('suggest-follows')
+    @click.option('--full', is_flag=True, help='重新计算所有用户，默认只计算有变化的用户')
+    @click.option('--batch-size', default=None, type=int,
+                  help='每个事务写入的用户数量，默认为 SUGGESTIONS_BATCH_SIZE')
+    def suggest_follows(full, batch_size):
+        '''离线计算“可能认识的人”'''
+        total = 0
+        for count in suggestions.refresh(full, batch_size=batch_size):
+            total += count
+            click.echo('已计算 {} 个用户的推荐'.format(total))
+        click.echo('推荐已更新')
+
+
+def iter_batches(model, batch_size):
+    '''按 id 顺序分批读取文档的 id 和正文'''
+    last_id = 0
+    while True:
+        rows = (db.session.query(model.id, model.body)
+                .filter(model.id > last_id).order_by(model.id)
+                .limit(batch_size).all())
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1].id
+
+
+def ordered_map(executor, func, iterable, window=8):
+    '''
+    与 executor.map 相同，但最多只有 window 个任务同时进行
+    executor.map 会一次性读完 iterable ，大数据表会占用大量内存
+    '''
+    pending = deque()
+    for item in iterable:
+        pending.append(executor.submit(func, item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
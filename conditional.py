@@ -0,0 +1,153 @@
+'''
+条件请求（ETag / Last-Modified）
+
+页面的校验值由页面数据的聚合值（最新的修改时间、最大和最小 id 等）
+和访问者身份共同决定，用一条聚合查询即可得到，不需要加载页面数据。
+浏览器或 CDN 发来的 If-None-Match / If-Modified-Since 与之匹配时，
+在渲染模板之前直接返回 304 。
+'''
+import hashlib
+import time
+from functools import wraps
+
+from flask import request, session, make_response, current_app
+from flask_login import current_user
+from sqlalchemy import func
+
+from models import db, User, Blog, Comment, ArchivedBlog, ArchivedComment
+from models import Suggestion
+
+
+def identity_class():
+    '''
+    访问者身份：未登录访客看到的页面都相同
+    已登录用户的页面包含用户名、编辑按钮和表单的 CSRF 令牌，
+    令牌有过期时间，所以按时间分段，过期前页面一定会重新生成
+    '''
+    if current_user.is_anonymous:
+        return 'anonymous'
+    period = current_app.config.get('WTF_CSRF_TIME_LIMIT') or 3600
+    return 'user:{}:{}:{}'.format(current_user.id, current_user.role_id,
+                                  int(time.time() // (period / 2)))
+
+
+def conditional(validator):
+    '''
+    视图函数的装饰器，validator 接收视图函数的参数，
+    返回 (最后修改时间, 聚合值元组)，返回 None 时不做处理（例如页面不存在）
+    '''
+
+    def decorator(view):
+        @wraps(view)
+        def decorated_view(*args, **kw):
+            # 有 flash 消息时页面内容不同，必须重新渲染
+            if request.method not in ('GET', 'HEAD') or '_flashes' in session:
+                return view(*args, **kw)
+            result = validator(*args, **kw)
+            if result is None:
+                return view(*args, **kw)
+            last_modified, values = result
+            etag = hashlib.sha1(repr((values, identity_class(),
+                                      request.full_path)).encode()).hexdigest()
+            if last_modified is not None:
+                last_modified = last_modified.replace(microsecond=0)
+            if not_modified(etag, last_modified):
+                response = current_app.response_class(status=304)
+            else:
+                response = make_response(view(*args, **kw))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            if last_modified is not None:
+                response.last_modified = last_modified
+            # 每次使用缓存之前都要向服务器确认
+            response.cache_control.no_cache = True
+            if not current_user.is_anonymous:
+                response.cache_control.private = True
+            # 同一个地址登录前后的页面不同，共享缓存要按 Cookie 区分
+            response.vary.add('Cookie')
+            return response
+
+        return decorated_view
+
+    return decorator
+
+
+def not_modified(etag, last_modified):
+    # 有 If-None-Match 时忽略 If-Modified-Since
+    if request.if_none_match:
+        return request.if_none_match.contains(etag)
+    if request.if_modified_since and last_modified is not None:
+        return last_modified <= request.if_modified_since
+    return False
+
+
+def latest(*times):
+    times = [t for t in times if t is not None]
+    return max(times) if times else None
+
+
+# 以下为各页面的校验值
+
+def blog_list_validator():
+    '''
+    首页：所有博客的最新修改时间、最大和最小 id ，以及用户资料的最新修改时间
+    页面上有作者的名字和头像，任何用户修改资料都让校验值变化，
+    按 updated_at 索引取最大值，比找出本页的作者再查询更快
+    '''
+    row = db.session.query(func.max(Blog.updated_at), func.max(Blog.id),
+                           func.min(Blog.id)).one()
+    authors = db.session.query(func.max(User.updated_at)).scalar()
+    return latest(row[0], authors), (tuple(row), authors)
+
+
+def blog_validator(id):
+    '''博客页面：博客本身和它的评论，找不到时查归档表'''
+    for blog_model, comment_model in ((Blog, Comment),
+                                      (ArchivedBlog, ArchivedComment)):
+        blog = (db.session.query(blog_model.id, blog_model.updated_at,
+                                 blog_model.author_id)
+                .filter_by(id=id).first())
+        if blog is not None:
+            break
+    else:
+        return None
+    comments = (db.session.query(func.max(comment_model.updated_at),
+                                 func.max(comment_model.id),
+                                 func.count(comment_model.id))
+                .filter(comment_model.blog_id == id).one())
+    # 博客作者和评论者的名字、头像
+    commenters = db.select([comment_model.author_id]).where(
+        comment_model.blog_id == id)
+    authors = (db.session.query(func.max(User.updated_at))
+               .filter(db.or_(User.id == blog.author_id,
+                              User.id.in_(commenters))).scalar())
+    last_modified = latest(blog.updated_at, comments[0], authors)
+    return last_modified, (tuple(blog), tuple(comments), authors)
+
+
+def profile_validator(name):
+    '''
+    用户主页：用户资料和该用户的博客
+    归档的数量和页面上的关注数、博客数都没有对应的时间戳，它们变化时
+    latest(user.updated_at, 博客, 活跃时间, 推荐) 不一定变化，
+    所以这个页面不发送 Last-Modified ，只用 ETag 判断
+    '''
+    user = User.query.filter_by(name=name).first()
+    if user is None:
+        return None
+    values = tuple(getattr(user, column.key)
+                   for column in User.__mapper__.column_attrs)
+    # 页面上的活跃时间可能还在内存中，没有写入数据库
+    seen = current_app.extensions['last_seen'].get(user.id)
+    blogs = (db.session.query(func.max(Blog.updated_at), func.max(Blog.id))
+             .filter(Blog.author_id == user.id).one())
+    # 归档只会移动博客，最大 id 可能不变，所以加上归档的数量
+    archived = (db.session.query(func.count(ArchivedBlog.id))
+                .filter(ArchivedBlog.author_id == user.id).scalar())
+    # 自己的主页上有“可能认识的人”，重新计算后页面也会变化
+    suggested = None
+    if current_user == user:
+        suggested = (db.session.query(func.max(Suggestion.computed_at))
+                     .filter(Suggestion.user_id == user.id).scalar())
+    return None, (repr(values), seen, tuple(blogs), archived, suggested)
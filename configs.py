@@ -13,6 +13,73 @@ class BaseConfig:
     BLOGS_PER_PAGE = 10
     USERS_PER_PAGE = 10
     COMMENTS_PER_PAGE = 10
+    # 分页方式，'keyset' 为游标分页，'offset' 为传统的页码分页
+    PAGINATION_MODE = 'keyset'
+    # 游标分页时是否显示数据表的近似总数（仅支持 MySQL）
+    PAGINATION_APPROXIMATE_TOTAL = True
+    # last_seen 批量写入的间隔（秒）和攒够多少个用户就立即写入
+    LAST_SEEN_FLUSH_INTERVAL = 60
+    LAST_SEEN_FLUSH_SIZE = 500
+    # 博客渲染结果的缓存条数
+    RENDER_CACHE_SIZE = 1024
+    # 正文超过这么多字符的博客交给后台线程渲染，None 表示全部同步渲染
+    RENDER_ASYNC_THRESHOLD = 20000
+    RENDER_WORKERS = 2
+    # 角色缓存的有效期（秒），其它进程修改角色后最多这么久生效
+    ROLE_CACHE_TTL = 300
+    # 已登录用户的缓存数量和有效期（秒）
+    IDENTITY_CACHE_SIZE = 10000
+    IDENTITY_CACHE_TTL = 60
+    # 未登录访客的页面缓存：是否启用、缓存条数和有效期（秒）
+    PAGE_CACHE_ENABLED = True
+    PAGE_CACHE_SIZE = 500
+    PAGE_CACHE_TTL = 300
+    SEARCH_RESULTS_PER_PAGE = 20
+    # 用户主页流式输出时每次查询和发送的博客数量
+    PROFILE_STREAM_CHUNK = 20
+    # 密码哈希的算法和迭代次数，修改后用户下次登录时自动重新计算
+    PASSWORD_HASH_METHOD = 'pbkdf2:sha256:150000'
+    PASSWORD_SALT_LENGTH = 16
+    # 计算密码哈希的进程数，None 为 CPU 核数
+    PASSWORD_HASH_WORKERS = None
+    # 各视图函数的频率限制：(按 'ip' 或 'user' 计数, 次数, 秒数[, 请求方法])
+    # 请求方法默认为 ('POST',)，见 ratelimit.py
+    RATE_LIMITS = {
+        'front.login': [('ip', 10, 60), ('ip', 100, 3600)],
+        'front.register': [('ip', 5, 3600)],
+        'front.blog': [('user', 5, 60)],  # 发表评论
+        'user.follow': [('user', 30, 60, ('GET',))],
+        'user.unfollow': [('user', 30, 60, ('GET',))],
+    }
+    # 应用前面有几层反向代理（Nginx、负载均衡等），
+    # 大于 0 时从 X-Forwarded-For / X-Forwarded-Proto 中取客户端的真实 IP 和协议，
+    # 否则 request.remote_addr 是代理的地址，所有访客共用同一个频率限制
+    TRUSTED_PROXIES = int(os.getenv('TRUSTED_PROXIES', 0))
+    # 多进程部署时共享计数的 Redis 地址，为 None 时每个进程单独计数
+    RATE_LIMIT_STORAGE_URL = os.getenv('RATE_LIMIT_STORAGE_URL')
+    # 批量删除评论时每个事务删除多少条
+    MODERATION_BATCH_SIZE = 500
+    # flask archive-blogs 默认归档多少天以前的博客，以及每个事务归档多少篇
+    ARCHIVE_AFTER_DAYS = 365
+    ARCHIVE_BATCH_SIZE = 200
+    # JSON 接口每页最多返回多少条，客户端用 limit 参数指定
+    API_MAX_PER_PAGE = 50
+    # 只读副本在 SQLALCHEMY_BINDS 中的名称，GET 请求的查询随机发送到其中一个
+    SQLALCHEMY_REPLICAS = []
+    # 用户写入数据后多少秒内的查询仍然发送到主库，保证能读到自己写的数据
+    REPLICA_STICKY_SECONDS = 5
+    # 耗时超过此秒数的请求在日志中记录最慢的 METRICS_SLOW_QUERIES 条 SQL
+    METRICS_SLOW_REQUEST = 1.0
+    METRICS_SLOW_QUERIES = 5
+    # 每个用户的物化关注动态最多保留多少条
+    TIMELINE_LENGTH = 500
+    # 粉丝数超过此值的作者发博客时不推送，读取动态时再合并
+    TIMELINE_FANOUT_THRESHOLD = 1000
+    # 每个用户保存多少个“可能认识的人”，个人主页显示多少个
+    SUGGESTIONS_PER_USER = 20
+    SUGGESTIONS_ON_PROFILE = 5
+    # flask suggest-follows 每个事务写入多少个用户的推荐
+    SUGGESTIONS_BATCH_SIZE = 500
     #SQLALCHEMY_TRACK_MODIFICATIONS = False
 
 
@@ -26,6 +93,17 @@ class DevConfig(BaseConfig):
     MAIL_USERNAME = os.getenv('MAIL_USERNAME')
     MAIL_PASSWORD = os.getenv('MAIL_PASSWORD')
     SQLALCHEMY_DATABASE_URI = os.getenv('SQLALCHEMY_DATABASE_URI')
+    # 只读副本的地址，多个副本以逗号分隔
+    SQLALCHEMY_BINDS = {
+        'replica{}'.format(i): uri for i, uri in enumerate(
+            filter(None, os.getenv('REPLICA_DATABASE_URIS', '').split(',')))}
+    SQLALCHEMY_REPLICAS = list(SQLALCHEMY_BINDS)
+    # 发送邮件的工作线程数、每批发送的邮件数和最大重试次数
+    MAIL_WORKERS = 2
+    MAIL_BATCH_SIZE = 20
+    MAIL_MAX_ATTEMPTS = 5
+    # 第 n 次重试前等待 MAIL_RETRY_BASE * 2 ** (n - 1) 秒
+    MAIL_RETRY_BASE = 30
 
 
 class TestConfig(BaseConfig):
@@ -33,11 +111,33 @@ class TestConfig(BaseConfig):
     测试阶段使用的配置类
     '''
 
-    pass
+    # 视图中的异常直接抛给测试，QueryGuard 超出预算时也会抛出异常
+    TESTING = True
+    # 单个请求执行的 SQL 语句超过此数量时令测试失败，用于发现 N+1 查询
+    MAX_QUERIES_PER_REQUEST = 15
+    # 测试时降低迭代次数并在当前线程中计算，加快测试速度
+    PASSWORD_HASH_METHOD = 'pbkdf2:sha256:1000'
+    PASSWORD_HASH_WORKERS = 0
+    # 测试中会反复登录，不限制频率
+    RATE_LIMIT_ENABLED = False
+
+
+class PerfConfig(BaseConfig):
+    '''
+    性能测试使用的配置类，见 benchmarks 包
+    '''
+
+    SECRET_KEY = os.getenv('SECRET_KEY') or 'benchmark'
+    SQLALCHEMY_DATABASE_URI = (os.getenv('PERF_DATABASE_URI') or
+                               'sqlite:///' + os.path.abspath('perf.db'))
+    WTF_CSRF_ENABLED = False
+    MAIL_SUPPRESS_SEND = True
+    RATE_LIMIT_ENABLED = False
 
 
 # 配置类字典，便于 app.py 文件中的应用调用
 configs = {
     'dev': DevConfig,
-    'test': TestConfig
+    'test': TestConfig,
+    'perf': PerfConfig
 }
\ No newline at end of file
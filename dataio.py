@@ -0,0 +1,199 @@
+'''
+批量导入和导出用户、关注、博客和评论，由 flask export-data / import-data 命令调用
+
+导出目录中每个数据表一个文件：users、follows、blogs、comments
+以及归档表 blogs_archive、comments_archive ，
+格式为 JSONL（每行一个 JSON 对象）或 CSV（第一行为列名）。
+时间使用 ISO 8601 格式，用户的角色使用角色名称，password 是密码的哈希值。
+
+导入时按块读取文件，用 Core 的 executemany 批量插入，不经过 ORM ，
+因此不会触发 Blog.body 的渲染、计数、搜索索引和时间线等逐行事件。
+博客的 Markdown 渲染和搜索分词在进程池中按块并行完成，
+全部导入后再统一重新统计计数、重建时间线。
+无论文件多大，内存中最多只有几个块的数据。
+'''
+import csv
+import enum
+import json
+import os
+from datetime import datetime
+from itertools import islice
+
+from sqlalchemy import Boolean, DateTime, Enum, Integer, tuple_
+
+from models import db, Role, User, Follow, Blog, Comment, Timeline, SearchPosting
+from models import ArchivedBlog, ArchivedComment
+from rendering import render_markdown
+from search import postings
+
+# (文件名, 模型, 导出的列)，按导入顺序排列
+TABLES = (
+    ('users', User, ('id', 'name', 'email', 'password', 'confirmed', 'role',
+                     'age', 'gender', 'phone_num', 'location', 'about_me',
+                     'avatar_hash', 'small_avatar_hash', 'create_at',
+                     'last_seen')),
+    ('follows', Follow, ('follower_id', 'followed_id', 'time_stamp')),
+    ('blogs', Blog, ('id', 'author_id', 'body', 'time_stamp', 'updated_at')),
+    ('comments', Comment, ('id', 'blog_id', 'author_id', 'body', 'disable',
+                           'time_stamp', 'updated_at')),
+    ('blogs_archive', ArchivedBlog, ('id', 'author_id', 'body', 'body_html',
+                                     'time_stamp', 'updated_at',
+                                     'archived_at')),
+    ('comments_archive', ArchivedComment, ('id', 'blog_id', 'author_id',
+                                           'body', 'disable', 'time_stamp',
+                                           'updated_at', 'archived_at')),
+)
+
+FORMATS = ('jsonl', 'csv')
+
+
+def encode(value):
+    '''把数据库中的值转换为 JSON 和 CSV 都能保存的值'''
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, enum.Enum):
+        return value.name
+    return value
+
+
+def decode(column, value):
+    '''把文件中的值转换为 column 对应的 Python 类型，空值使用列的默认值'''
+    if value is None or value == '':
+        default = column.default
+        if default is None:
+            return None
+        return default.arg(None) if default.is_callable else default.arg
+    kind = column.type
+    if isinstance(kind, Enum):
+        return kind.enum_class[value] if kind.enum_class else value
+    if isinstance(kind, Boolean) and isinstance(value, str):
+        return value.lower() in ('1', 'true', 'yes')
+    if isinstance(kind, Integer):
+        return int(value)
+    if isinstance(kind, DateTime) and isinstance(value, str):
+        return datetime.fromisoformat(value)
+    return value
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def iter_rows(table, chunk_size):
+    '''按主键顺序分块读取整个数据表（keyset 分页，不使用 OFFSET ）'''
+    keys = list(table.primary_key.columns)
+    last = None
+    while True:
+        query = db.select([table]).order_by(*keys).limit(chunk_size)
+        if last is not None:
+            query = query.where(tuple_(*keys) > tuple_(*last) if len(keys) > 1
+                                else keys[0] > last[0])
+        rows = db.session.execute(query).fetchall()
+        if not rows:
+            return
+        yield from rows
+        last = [rows[-1][key] for key in keys]
+
+
+def export_table(name, model, columns, directory, fmt, chunk_size):
+    '''导出一个数据表，返回导出的行数'''
+    table = model.__table__
+    roles = {info.id: info.name for info in Role.cached().values()}
+    path = os.path.join(directory, '{}.{}'.format(name, fmt))
+    total = 0
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        if fmt == 'csv':
+            writer = csv.DictWriter(f, columns)
+            writer.writeheader()
+        for row in iter_rows(table, chunk_size):
+            record = {}
+            for column in columns:
+                if column == 'role':
+                    record[column] = roles.get(row[table.c.role_id])
+                else:
+                    record[column] = encode(row[table.c[column]])
+            if fmt == 'csv':
+                writer.writerow(record)
+            else:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+            total += 1
+    return total
+
+
+def read_records(path, fmt):
+    '''逐行读取文件，每次返回一个字典'''
+    with open(path, encoding='utf-8', newline='') as f:
+        if fmt == 'csv':
+            yield from csv.DictReader(f)
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def to_rows(model, columns, records):
+    '''把文件中的记录转换为可以直接插入数据表的字典，每行的键都相同'''
+    table = model.__table__
+    roles = {info.name: info.id for info in Role.cached().values()}
+    default_role = Role.default_id()
+    for record in records:
+        row = {}
+        for column in columns:
+            value = record.get(column)
+            if column == 'role':
+                row['role_id'] = roles.get(value, default_role)
+            else:
+                row[column] = decode(table.c[column], value)
+        yield row
+
+
+def prepare_blogs(rows):
+    '''在子进程中渲染一块博客的 Markdown 并生成搜索索引'''
+    index = []
+    for row in rows:
+        row['body_html'] = render_markdown(row['body'] or '')
+        index.extend(postings('b', row['id'], row['body']))
+    return rows, index
+
+
+def prepare_comments(rows):
+    '''在子进程中为一块评论生成搜索索引'''
+    index = []
+    for row in rows:
+        index.extend(postings('c', row['id'], row['body']))
+    return rows, index
+
+
+PREPARE = {'blogs': prepare_blogs, 'comments': prepare_comments}
+
+
+def import_table(name, model, columns, path, fmt, chunk_size, mapper):
+    '''
+    导入一个数据表，返回导入的行数
+    mapper 是 commands.ordered_map 绑定了进程池的函数，用于并行处理博客和评论
+    '''
+    rows = to_rows(model, columns, read_records(path, fmt))
+    chunks = chunked(rows, chunk_size)
+    if name in PREPARE:
+        results = mapper(PREPARE[name], chunks)
+    else:
+        results = ((chunk, []) for chunk in chunks)
+    total = 0
+    for chunk, index in results:
+        db.session.execute(model.__table__.insert(), chunk)
+        if index:
+            db.session.execute(SearchPosting.__table__.insert(), index)
+        db.session.commit()
+        total += len(chunk)
+    return total
+
+
+def finish_import():
+    '''导入时跳过的逐行事件，在这里一次性补上'''
+    User.reconcile_counters()
+    Timeline.rebuild()
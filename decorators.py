@@ -11,7 +11,9 @@ def permission_required(permission):
     def decorator(func):
         @wraps(func)
         def decorated_func(*args, **kw):
-            if not current_user.role.permissions & permission:
+            # 权限从角色缓存中读取，不查询数据库
+            if not (current_user.is_authenticated and
+                    current_user.has_permission(permission)):
                 flash('你这个号级别不够啊！', 'warning')
                 abort(403)
             return func(*args, **kw)  #满足条件执行func
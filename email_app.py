@@ -1,39 +1,193 @@
-from flask import current_app, render_template, flash
+import smtplib
+import uuid
+from datetime import datetime, timedelta
+from threading import Thread, Event, Lock
+
+from flask import current_app, render_template
 from flask_mail import Mail, Message
-from threading import Thread
+from sqlalchemy import case, func
+
+from models import db, Outbox
+from metrics import timed
+
+
+class MailWorkerPool:
+    '''
+    邮件发送线程池
+    邮件先写入 outbox 数据表，进程重启也不会丢失
+    固定数量的工作线程从表中批量领取邮件，每批邮件共用一个 SMTP 连接
+    发送失败的邮件按指数退避重试，超过最大次数后标记为 failed
+    '''
+
+    def __init__(self, app=None):
+        self.app = None
+        self.mail = None
+        self._threads = []
+        self._wakeup = Event()
+        self._lock = Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('MAIL_WORKERS', 2)
+        app.config.setdefault('MAIL_BATCH_SIZE', 20)
+        app.config.setdefault('MAIL_MAX_ATTEMPTS', 5)
+        app.config.setdefault('MAIL_RETRY_BASE', 30)
+        app.config.setdefault('MAIL_POLL_INTERVAL', 5)
+        app.config.setdefault('MAIL_CLAIM_TIMEOUT', 600)
+        self.app = app
+        # 整个应用只创建一个 Mail 实例
+        self.mail = Mail(app)
+        app.extensions['mail_pool'] = self
+        # 重启前没有发出的邮件不必等到有新邮件时才发送
+        app.before_first_request(self.wake)
+
+    def wake(self):
+        '''有新邮件时唤醒工作线程，第一次调用时启动线程'''
+        with self._lock:
+            if not self._threads:
+                for i in range(self.app.config['MAIL_WORKERS']):
+                    thread = Thread(target=self._run, daemon=True,
+                                    name='mail-worker-{}'.format(i))
+                    thread.start()
+                    self._threads.append(thread)
+        self._wakeup.set()
+
+    def _run(self):
+        while True:
+            with self.app.app_context():
+                try:
+                    self.recover()
+                    sent = self.send_batch()
+                except Exception:
+                    self.app.logger.exception('发送邮件失败')
+                    sent = 0
+                finally:
+                    db.session.remove()
+            if not sent:
+                self._wakeup.wait(self.app.config['MAIL_POLL_INTERVAL'])
+                self._wakeup.clear()
+
+    def recover(self):
+        '''
+        领取后长时间没有结果的邮件（例如进程崩溃）重新放回待发送状态
+        同样计入重试次数，反复导致崩溃的邮件最终会被标记为 failed
+        '''
+        timeout = timedelta(seconds=self.app.config['MAIL_CLAIM_TIMEOUT'])
+        max_attempts = self.app.config['MAIL_MAX_ATTEMPTS']
+        attempts = func.coalesce(Outbox.attempts, 0)
+        # 先给 status 赋值：MySQL 按顺序执行赋值，这里读到的仍是原来的次数
+        Outbox.query.filter(Outbox.status == 'sending',
+                            Outbox.claimed_at < datetime.utcnow() - timeout
+                            ).update([
+                                (Outbox.status,
+                                 case([(attempts + 1 >= max_attempts, 'failed')],
+                                      else_='pending')),
+                                (Outbox.attempts, attempts + 1),
+                                (Outbox.last_error, '领取后超时未完成')],
+                                synchronize_session=False,
+                                update_args={'preserve_parameter_order': True})
+        db.session.commit()
 
+    def claim(self):
+        '''领取一批到期的邮件，其它线程或进程不会领取到同一封'''
+        now = datetime.utcnow()
+        ids = [row.id for row in db.session.query(Outbox.id)
+               .filter(Outbox.status == 'pending', Outbox.next_attempt_at <= now)
+               .order_by(Outbox.id).limit(self.app.config['MAIL_BATCH_SIZE'])]
+        if not ids:
+            return []
+        token = uuid.uuid4().hex
+        Outbox.query.filter(Outbox.id.in_(ids), Outbox.status == 'pending'
+                            ).update({Outbox.status: 'sending',
+                                      Outbox.claimed_by: token,
+                                      Outbox.claimed_at: now},
+                                     synchronize_session=False)
+        db.session.commit()
+        return Outbox.query.filter_by(claimed_by=token, status='sending').all()
 
-def send_async_email(app, msg):
-    '''该函数作为线程类实例化时 target 参数的值，在线程中执行'''
+    def send_batch(self):
+        '''发送一批邮件，返回领取到的邮件数量'''
+        entries = self.claim()
+        if not entries:
+            return 0
+        sent = []
+        current = None
+        try:
+            # 同一批邮件共用一个 SMTP 连接
+            with self.mail.connect() as conn:
+                for entry in entries:
+                    current = entry
+                    try:
+                        conn.send(Message(entry.subject, sender=entry.sender,
+                                          recipients=entry.recipients.split(','),
+                                          body=entry.body, html=entry.html))
+                        sent.append(entry.id)
+                    except smtplib.SMTPServerDisconnected:
+                        raise
+                    except smtplib.SMTPException as e:
+                        # 收件人被拒绝等只影响这一封邮件
+                        self.retry(entry, e)
+                    except OSError:
+                        # 网络错误，连接已经不能用了
+                        raise
+                    except Exception as e:
+                        # 数据有问题等无法构造或发送这一封，不影响其它邮件
+                        self.retry(entry, e)
+                current = None
+        except (smtplib.SMTPException, OSError) as e:
+            # 连接断开或无法连接服务器
+            for entry in entries:
+                if entry.id in sent or entry.status != 'sending':
+                    continue
+                if current is None or entry is current:
+                    # 连不上服务器，或者正在发送的这一封，计入重试次数
+                    self.retry(entry, e)
+                else:
+                    # 还没有轮到的邮件放回去，留给下一批
+                    entry.status = 'pending'
+                    db.session.add(entry)
+        finally:
+            # 即使出现意外的异常，已经发出的邮件也要标记为 sent ，以免重复发送
+            if sent:
+                Outbox.query.filter(Outbox.id.in_(sent)).update(
+                    {Outbox.status: 'sent', Outbox.sent_at: datetime.utcnow()},
+                    synchronize_session=False)
+            db.session.commit()
+        return len(entries)
 
-    with app.app_context():
-        Mail(app).send(msg)
+    def retry(self, entry, error):
+        '''记录失败原因，并按指数退避安排下一次发送'''
+        entry.attempts += 1
+        entry.last_error = repr(error)
+        if entry.attempts >= self.app.config['MAIL_MAX_ATTEMPTS']:
+            entry.status = 'failed'
+        else:
+            delay = self.app.config['MAIL_RETRY_BASE'] * 2 ** (entry.attempts - 1)
+            entry.status = 'pending'
+            entry.next_attempt_at = datetime.utcnow() + timedelta(seconds=delay)
+        db.session.add(entry)
 
 
 def send_email(user, email, tmp, token):
     '''
     发送邮件的主函数，参数分别是：
     当前登录用户，收件人的邮箱，前端文件名片段，token
+    邮件写入 outbox 数据表后由 MailWorkerPool 的工作线程发送
     '''
 
-    # 如果使用多线程，就不能用 current_app 了，它被看作是一个代理
-    # 类似 socket 服务器中的主套接字，每次接收请求后都要创建一个临时套接字去处理
-    # 此处使用 current_app 对象的 _get_curent_object 方法
-    # 新创建的临时应用对象 app 包含独立的上下文信息，交给子线程处理
-    app = current_app._get_current_object()
-    # Message 是一个类，它接收以下参数：
-    # 1、默认参数 subject 字符串（邮件主题
-    # 2、sender 字符串（发件人邮箱
-    # 3、recipients 列表（收件人邮箱列表
-    msg = Message(
-            'To: ' + user.name,
-            sender = app.config.get('MAIL_USERNAME'),
-            recipients = [email]
-    )
-    msg.body = render_template('email/{}.txt'.format(tmp), user=user,
-            token=token)    # 纯文本文件
-    msg.html = render_template('email/{}.html'.format(tmp), user=user,
-            token=token)    # HTML 文件
-    thread = Thread(target=send_async_email, args=(app, msg))
-    thread.start()          # 创建一个子线程并启动
-    return thread
\ No newline at end of file
+    with timed('email'):
+        app = current_app._get_current_object()
+        entry = Outbox(
+                subject='To: ' + user.name,
+                sender=app.config.get('MAIL_USERNAME'),
+                recipients=email,
+                body=render_template('email/{}.txt'.format(tmp), user=user,
+                                     token=token),    # 纯文本文件
+                html=render_template('email/{}.html'.format(tmp), user=user,
+                                     token=token)     # HTML 文件
+        )
+        db.session.add(entry)
+        db.session.commit()
+    app.extensions['mail_pool'].wake()
+    return entry
@@ -115,8 +115,8 @@ class AdminProfileForm(ProfileForm):
     def __init__(self, user, *args, **kw):
         super().__init__(user, *args, **kw)
         # 初始化表单类实例时，需要定义好 SelectField 所需的选项列表
-        self.role_id.choices = [(role.id, role.name)
-                                for role in Role.query.order_by(Role.permissions)]
+        self.role_id.choices = [(role.id, role.name) for role in sorted(
+            Role.cached().values(), key=lambda role: role.permissions)]
 
 
 class ChangePasswordForm(FlaskForm):
@@ -181,3 +181,15 @@ class BlogForm(FlaskForm):
 class CommentForm(FlaskForm):
     body = TextAreaField('', validators=[DataRequired()])
     submit = SubmitField('Submit')
+
+
+class ModerateCommentsForm(FlaskForm):
+    '''批量审核评论，所选评论的 id 由列表中的复选框提交'''
+    action = SelectField('操作', choices=[('disable', '隐藏'), ('enable', '恢复'),
+                                        ('purge', '删除')])
+    scope = SelectField('范围', choices=[('ids', '所选的评论'),
+                                       ('author', '该作者的所有评论'),
+                                       ('blog', '该博客的所有评论')])
+    author = StringField('作者', validators=[Optional()])
+    blog = IntegerField('博客 ID', validators=[Optional()])
+    submit = SubmitField('执行')
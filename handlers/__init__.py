@@ -0,0 +1,7 @@
+from .front import front
+from .user import user
+from .admin import admin
+from .api import api
+
+# app.register_blueprints 按顺序注册的蓝图列表
+blueprint_list = [front, user, admin, api]
@@ -0,0 +1,74 @@
+'''
+管理员和协管员使用的视图函数
+'''
+from flask import Blueprint, current_app, Response, render_template, request
+from flask import redirect, url_for, flash
+from flask_login import login_required
+
+import sys
+
+sys.path.append('..')
+
+from models import User, Comment
+from forms import ModerateCommentsForm
+from decorators import admin_required, moderate_required
+from pagination import paginate
+import moderation
+
+admin = Blueprint('admin', __name__, url_prefix='/admin')
+
+
+@admin.route('/metrics')
+@login_required
+@admin_required
+def metrics():
+    '''Prometheus 格式的性能统计数据'''
+    page_cache = current_app.extensions['page_cache']
+    extra = {'page_cache_{}_total'.format(name): value
+             for name, value in page_cache.stats.items()}
+    extra['rate_limited_total'] = (
+        current_app.extensions['rate_limiter'].stats['limited'])
+    text = current_app.extensions['metrics'].prometheus(extra)
+    return Response(text, mimetype='text/plain; version=0.0.4')
+
+
+@admin.route('/comments', methods=['GET', 'POST'])
+@login_required
+@moderate_required
+def comments():
+    '''评论审核队列：按作者或博客筛选评论，批量隐藏、恢复或删除'''
+    form = ModerateCommentsForm()
+    if form.validate_on_submit():
+        author = None
+        if form.author.data:
+            author = User.query.filter_by(name=form.author.data).first()
+            if author is None:
+                flash('用户不存在。', 'warning')
+                return redirect(url_for('.comments'))
+        scope = form.scope.data
+        try:
+            count = moderation.apply(
+                form.action.data,
+                ids=request.form.getlist('ids', type=int)
+                if scope == 'ids' else None,
+                author_id=author.id if scope == 'author' and author else None,
+                blog_id=form.blog.data if scope == 'blog' else None)
+        except ValueError:
+            flash('请先选择评论，或填写作者或博客 ID 。', 'warning')
+        else:
+            flash('已处理 {} 条评论。'.format(count), 'success')
+        return redirect(url_for('.comments', author=form.author.data or None,
+                                blog=form.blog.data))
+
+    form.author.data = request.args.get('author')
+    form.blog.data = request.args.get('blog', type=int)
+    query = Comment.with_authors(Comment.query)
+    if form.author.data:
+        author = User.query.filter_by(name=form.author.data).first_or_404()
+        query = query.filter(Comment.author_id == author.id)
+    if form.blog.data:
+        query = query.filter(Comment.blog_id == form.blog.data)
+    pagination = paginate(query, (Comment.time_stamp, Comment.id),
+                          per_page=current_app.config['COMMENTS_PER_PAGE'])
+    return render_template('admin/comments.html', form=form,
+                           pagination=pagination, comments=pagination.items)
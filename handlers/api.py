@@ -0,0 +1,217 @@
+'''
+JSON 接口，供移动客户端使用，不渲染模板
+除了协管员的评论审核接口，其它接口都是只读的。
+
+所有列表都使用游标分页，响应格式为：
+    {"items": [...], "next": "下一页的游标", "prev": "上一页的游标"}
+请求下一页时把游标作为 cursor 参数传回，limit 参数指定每页数量。
+JSON 不缩进、不转义中文，尽量减小响应体积。
+'''
+import json
+import sys
+
+sys.path.append('..')
+
+from flask import Blueprint, abort, request, current_app
+from flask_login import current_user
+
+from models import User, Blog, Comment, Follow, Permission
+from pagination import keyset_paginate
+from conditional import conditional, blog_list_validator, blog_validator
+from conditional import profile_validator
+from decorators import moderate_required
+import moderation
+import archive
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+
+def api_response(data, status=200):
+    '''紧凑格式的 JSON 响应'''
+    return current_app.response_class(
+        json.dumps(data, ensure_ascii=False, separators=(',', ':')),
+        status=status, mimetype='application/json')
+
+
+@api.errorhandler(404)
+def not_found(e):
+    return api_response({'error': 'not found'}, 404)
+
+
+@api.errorhandler(403)
+def forbidden(e):
+    return api_response({'error': 'forbidden'}, 403)
+
+
+@api.errorhandler(429)
+def too_many_requests(e):
+    response = api_response({'error': 'too many requests'}, 429)
+    if getattr(e, 'retry_after', None):
+        response.headers['Retry-After'] = str(e.retry_after)
+    return response
+
+
+def iso(value):
+    return value.isoformat() if value else None
+
+
+def per_page(default):
+    limit = request.args.get('limit', default, type=int)
+    return max(1, min(limit, current_app.config['API_MAX_PER_PAGE']))
+
+
+def paginate(query, columns, default, archived=None):
+    return keyset_paginate(query, columns, request.args.get('cursor'),
+                           per_page(default), archive=archived)
+
+
+def dump_page(pagination, dump):
+    return {'items': [dump(item) for item in pagination.items],
+            'next': pagination.next_cursor, 'prev': pagination.prev_cursor}
+
+
+def dump_author(user):
+    return {'name': user.name, 'avatar': user.small_gravatar()}
+
+
+def dump_user(user):
+    return {'name': user.name, 'avatar': user.gravatar(),
+            'location': user.location, 'about_me': user.about_me,
+            'followers_count': user.followers_count,
+            'followed_count': user.followed_count,
+            'blogs_count': user.blogs_count,
+            'create_at': iso(user.create_at), 'last_seen': iso(
+                current_app.extensions['last_seen'].last_seen(user))}
+
+
+def dump_blog(blog):
+    # body_html 为 None 时博客还在后台渲染，客户端可以先显示 body
+    return {'id': blog.id, 'author': dump_author(blog.author),
+            'body': blog.body, 'body_html': blog.body_html,
+            'time_stamp': iso(blog.time_stamp),
+            'updated_at': iso(blog.updated_at), 'archived': blog.archived}
+
+
+def dump_comment(comment):
+    # 被隐藏的评论只有协管员可以看到内容
+    hidden = comment.disable and not (
+        current_user.is_authenticated and
+        current_user.has_permission(Permission.MODERATE))
+    return {'id': comment.id, 'author': dump_author(comment.author),
+            'body': None if hidden else comment.body,
+            'disabled': bool(comment.disable),
+            'time_stamp': iso(comment.time_stamp)}
+
+
+def comments_page(blog):
+    return dump_page(paginate(*archive.comments_of(blog),
+                              current_app.config['COMMENTS_PER_PAGE']),
+                     dump_comment)
+
+
+@api.route('/blogs')
+@conditional(blog_list_validator)
+def blogs():
+    '''首页的博客列表'''
+    pagination = paginate(Blog.with_authors(Blog.query),
+                          (Blog.time_stamp, Blog.id),
+                          current_app.config['BLOGS_PER_PAGE'])
+    return api_response(dump_page(pagination, dump_blog))
+
+
+@api.route('/blogs/<int:id>')
+@conditional(blog_validator)
+def blog(id):
+    '''博客和第一页评论'''
+    blog = archive.get_blog(id)
+    if blog is None:
+        abort(404)
+    return api_response({'blog': dump_blog(blog),
+                         'comments': comments_page(blog)})
+
+
+@api.route('/blogs/<int:id>/comments')
+@conditional(blog_validator)
+def comments(id):
+    blog = archive.get_blog(id)
+    if blog is None:
+        abort(404)
+    return api_response(comments_page(blog))
+
+
+@api.route('/users/<name>')
+@conditional(profile_validator)
+def user(name):
+    user = User.query.filter_by(name=name).first_or_404()
+    return api_response(dump_user(user))
+
+
+@api.route('/users/<name>/blogs')
+@conditional(profile_validator)
+def user_blogs(name):
+    user = User.query.filter_by(name=name).first_or_404()
+    pagination = paginate(Blog.with_authors(user.blogs),
+                          (Blog.time_stamp, Blog.id),
+                          current_app.config['BLOGS_PER_PAGE'],
+                          archive.archived_blogs_of(user))
+    return api_response(dump_page(pagination, dump_blog))
+
+
+@api.route('/users/<name>/followers')
+def followers(name):
+    user = User.query.filter_by(name=name).first_or_404()
+    pagination = paginate(user.followers,
+                          (Follow.time_stamp, Follow.follower_id),
+                          current_app.config['USERS_PER_PAGE'])
+    return api_response(dump_page(pagination, lambda follow: {
+        'user': dump_author(follow.follower),
+        'time_stamp': iso(follow.time_stamp)}))
+
+
+@api.route('/users/<name>/followed')
+def followed(name):
+    user = User.query.filter_by(name=name).first_or_404()
+    pagination = paginate(user.followed,
+                          (Follow.time_stamp, Follow.followed_id),
+                          current_app.config['USERS_PER_PAGE'])
+    return api_response(dump_page(pagination, lambda follow: {
+        'user': dump_author(follow.followed),
+        'time_stamp': iso(follow.time_stamp)}))
+
+
+@api.route('/feed')
+def feed():
+    '''当前用户的关注动态，最多 limit 条，需要登录'''
+    if not current_user.is_authenticated:
+        return api_response({'error': 'login required'}, 401)
+    limit = per_page(current_app.config['BLOGS_PER_PAGE'])
+    blogs = current_user.feed(limit)
+    return api_response({'items': [dump_blog(blog) for blog in blogs]})
+
+
+@api.route('/moderation/comments', methods=['POST'])
+@moderate_required
+def moderate_comments():
+    '''
+    批量审核评论，请求体为 JSON ：
+        {"action": "disable" | "enable" | "purge",
+         "ids": [评论 id, ...], "author": "用户名", "blog_id": 博客 id}
+    ids 、author 、blog_id 至少提供一个，同时提供时取交集
+    只接受 application/json 请求，跨站表单无法伪造
+    '''
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return api_response({'error': 'json body required'}, 400)
+    author_id = None
+    if data.get('author'):
+        author = User.query.filter_by(name=data['author']).first_or_404()
+        author_id = author.id
+    try:
+        ids = [int(id) for id in data.get('ids') or []]
+        blog_id = data.get('blog_id')
+        count = moderation.apply(
+            data.get('action'), ids=ids, author_id=author_id,
+            blog_id=int(blog_id) if blog_id is not None else None)
+    except (ValueError, TypeError) as e:
+        return api_response({'error': str(e)}, 400)
+    return api_response({'count': count})
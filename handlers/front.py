@@ -8,9 +8,15 @@ from flask import render_template, current_app, make_response
 from flask_login import login_required, login_user, logout_user, current_user
 
 from forms import RegisterForm, LoginForm, BlogForm, CommentForm
-from models import db, User, Blog, Comment, Permission
+from models import db, User, Blog, Comment, Permission, Timeline
 from email_app import send_email
 from decorators import moderate_required
+from replicas import primary_required
+from pagination import paginate
+from page_cache import page_cache
+import search as search_index
+import archive
+from conditional import conditional, blog_list_validator, blog_validator
 
 # build the blueprint
 front = Blueprint('front', __name__)
@@ -25,7 +31,8 @@ def before_request():
     # current_user 默认为匿名用户，其 is_authenticated 属性值为 False
     # 用户登录后，current_user 为登录用户，is_authenticated 属性值为 True
     if current_user.is_authenticated:
-        current_user.ping()  # fresh the last_seen
+        # fresh the last_seen，由 LastSeenTracker 合并后批量写入
+        current_app.extensions['last_seen'].touch(current_user.id)
         # 未验证的用户登录后要发出 POST 请求的话，让用户先通过验证
         # 如果用户未通过邮箱确认身份，且为 POST 请求
         if (not current_user.confirmed) and (request.method == 'POST'):
@@ -34,6 +41,8 @@ def before_request():
 
 
 @front.route('/', methods=['GET', 'POST'])
+@conditional(blog_list_validator)
+@page_cache.cached_page
 def index():
     '''网站首页'''
     form = BlogForm()
@@ -44,18 +53,22 @@ def index():
             form.populate_obj(blog)
             blog.author = current_user
             db.session.add(blog)
+            db.session.flush()
+            # 推送到关注者的时间线
+            Timeline.fan_out(blog)
             db.session.commit()
             flash('成功发布博客', 'success')
             return redirect(url_for('.index'))
-    page = request.args.get('page', 1, type=int)
-    pagination = Blog.query.order_by(Blog.time_stamp.desc()).paginate(
-        page,
-        per_page=current_app.config['BLOGS_PER_PAGE'],
-        error_out=False
-    )
+    pagination = paginate(Blog.with_authors(Blog.query),
+                          (Blog.time_stamp, Blog.id),
+                          per_page=current_app.config['BLOGS_PER_PAGE'],
+                          total_of=Blog)
     blogs = pagination.items
+    page_cache.tag('blogs')
+    page_cache.tag_blogs(blogs)
+    blogs_html = page_cache.fragment('_blogs.html', blogs=blogs)
     return render_template('index.html', form=form, blogs=blogs,
-                           pagination=pagination)
+                           pagination=pagination, blogs_html=blogs_html)
 
 
 @front.route('/unconfirmed_user')
@@ -67,6 +80,7 @@ def unconfirmed_user():
 
 
 @front.route('/repeat_confirm')
+@primary_required
 @login_required
 def resend_confirm_email():
     token = current_user.generate_confirm_user_token()
@@ -98,6 +112,11 @@ def login():
             flash('We cannot recognize the email provided. :<', 'info')
             # return redirect(url_for('.register'))
         elif user and user.verify_password(form.password.data):
+            # 用新的算法参数重新计算密码哈希
+            if user.password_needs_rehash():
+                user.password = form.password.data
+                db.session.add(user)
+                db.session.commit()
             login_user(user, form.remember_me.data)
             flash('You have logged in successfully, {}'.format(user.name), 'success')
             if not user.confirmed:
@@ -110,6 +129,7 @@ def login():
 # 用户注册之后，先在浏览器上登录，然后使用邮件确认账户的邮箱是否准确
 # 新注册用户收到验证邮件后，通过点击邮件中提供的地址请求验证
 @front.route('/confirm-user/<token>')
+@primary_required
 @login_required
 def confirm_user(token):
     if current_user.confirmed:
@@ -134,36 +154,68 @@ def page_not_found(e):
     return render_template('404.html'), 404
 
 
+@front.app_errorhandler(429)
+def too_many_requests(e):
+    response = make_response(render_template('429.html'), 429)
+    if getattr(e, 'retry_after', None):
+        response.headers['Retry-After'] = str(e.retry_after)
+    return response
+
+
 @front.app_errorhandler(500)
 def inter_server_error(e):
     return render_template('500.html'), 500
 
 @front.route('/blog/<int:id>', methods=['GET', 'POST'])
+@conditional(blog_validator)
+@page_cache.cached_page
 def blog(id):
     '''每篇博客的单独页面，便于分享'''
-    blog = Blog.query.get_or_404(id)
+    # 找不到时读取归档表，归档的博客不能评论
+    blog = archive.get_blog(id)
+    if blog is None:
+        abort(404)
     # 页面提供评论输入框
     form = CommentForm()
-    if form.validate_on_submit():
+    if not blog.archived and form.validate_on_submit():
         comment = Comment(body=form.body.data, blog=blog, author=current_user)
         db.session.add(comment)
         db.session.commit()
         flash('评论成功。', 'success')
         return redirect(url_for('.blog', id=id))
-    page = request.args.get('page', default=1, type=int)
-    pagination = blog.comments.order_by(Comment.time_stamp.desc()).paginate(
-            page,
-            per_page = current_app.config['COMMENTS_PER_PAGE'],
-            error_out = False
-    )
+    pagination = paginate(*archive.comments_of(blog),
+                          per_page=current_app.config['COMMENTS_PER_PAGE'])
     comments = pagination.items
+    page_cache.tag('blog:{}'.format(blog.id))
+    page_cache.tag_blogs([blog])
+    page_cache.tag_comments(comments)
     # hidebloglink 在博客页面中隐藏博客单独页面的链接
     # noblank 在博客页面中点击编辑按钮不在新标签页中打开
+    blogs_html = page_cache.fragment('_blogs.html', blogs=[blog],
+                                     hidebloglink=True, noblank=True)
+    comments_html = page_cache.fragment('_comments.html', comments=comments)
     return render_template('blog.html', blogs=[blog], hidebloglink=True,
             noblank=True, form=form, pagination=pagination,
-            comments=comments, Permission=Permission)
+            comments=comments, Permission=Permission,
+            blogs_html=blogs_html, comments_html=comments_html)
+
+@front.route('/search')
+def search():
+    '''搜索博客和评论'''
+    q = request.args.get('q', '').strip()
+    # 页码小于 1 时偏移量为负数，按第一页处理
+    page = max(request.args.get('page', default=1, type=int), 1)
+    per_page = current_app.config['SEARCH_RESULTS_PER_PAGE']
+    hits = search_index.search(q, limit=per_page + 1,
+                               offset=(page - 1) * per_page) if q else []
+    blogs, comments = search_index.load_results(hits[:per_page])
+    return render_template('search.html', q=q, blogs=blogs,
+                           comments=comments, page=page,
+                           has_next=len(hits) > per_page)
+
 
 @front.route('/comment/disable/<int:id>')
+@primary_required
 @moderate_required
 def disable_comment(id):
     '''管理员封禁评论'''
@@ -175,6 +227,7 @@ def disable_comment(id):
 
 
 @front.route('/comment/enable/<int:id>')
+@primary_required
 @moderate_required
 def enable_comment(id):
     '''管理员解封评论'''
@@ -3,25 +3,35 @@
 '''
 # 若产生报错 'Permission' is undefined，则可能是导入顺序问题，请将下列覆盖到之前导入函数
 from datetime import datetime
+from itertools import chain
 from flask import Blueprint, abort, redirect, url_for, flash, render_template
-from flask import request, current_app
+from flask import request, current_app, Response, stream_with_context
 from flask_login import login_required, login_user, current_user
 
 import sys
 
 sys.path.append('..')
 
-from models import db, User, Role, Blog
+from models import db, User, Role, Blog, Follow, Timeline, ArchivedBlog
+from models import Suggestion
 from forms import ProfileForm, AdminProfileForm, ChangePasswordForm, BlogForm
 from forms import BeforeResetPasswordForm, ResetPasswordForm, ChangeEmailForm
 from decorators import admin_required
+from replicas import primary_required
 from email_app import send_email
+from pagination import paginate
+from page_cache import page_cache
+import archive
+import relations
+from conditional import conditional, profile_validator
 
 user = Blueprint('user', __name__, url_prefix='/user')
 
 
 
 @user.route('/<name>/index')
+@conditional(profile_validator)
+@page_cache.cached_page
 def index(name):
 
     class Permission:
@@ -34,9 +44,54 @@ def index(name):
     user = User.query.filter_by(name=name).first()
     if not user:
         abort(404)
-    blogs = user.blogs.order_by(Blog.time_stamp.desc())
-
-    return render_template('user/index.html', user=user, blogs=blogs, permission=Permission)
+    # 只在自己的主页上显示“可能认识的人”
+    suggested = Suggestion.for_user(user) if current_user == user else []
+    if request.args.get('stream', type=int):
+        # 流式输出：先发送用户信息，博客列表分批查询、分批发送
+        # 所有博客的作者都是 user ，不需要连表加载作者
+        chunk = current_app.config['PROFILE_STREAM_CHUNK']
+        archived, _ = archive.archived_blogs_of(user)
+        blogs = chain(
+            user.blogs.order_by(Blog.time_stamp.desc(), Blog.id.desc()
+                                ).yield_per(chunk),
+            archived.order_by(ArchivedBlog.time_stamp.desc(),
+                              ArchivedBlog.id.desc()).yield_per(chunk))
+        return Response(stream_with_context(stream_template(
+            'user/index.html', user=user, blogs=blogs, permission=Permission,
+            pagination=None,
+            relation=relations.relation(current_user, user),
+            suggested=suggested)))
+    # 归档的旧博客接在最后，两个表合并分页
+    pagination = paginate(Blog.with_authors(user.blogs),
+                          (Blog.time_stamp, Blog.id),
+                          per_page=current_app.config['BLOGS_PER_PAGE'],
+                          archive=archive.archived_blogs_of(user))
+    blogs = pagination.items
+    page_cache.tag('user:{}'.format(user.id))
+    page_cache.tag_blogs(blogs)
+    blogs_html = page_cache.fragment('_blogs.html', blogs=blogs)
+
+    return render_template('user/index.html', user=user, blogs=blogs, permission=Permission,
+                           blogs_html=blogs_html, pagination=pagination,
+                           relation=relations.relation(current_user, user),
+                           suggested=suggested)
+
+
+def stream_template(template_name, **context):
+    '''逐段渲染模板，配合 stream_with_context 使用'''
+    current_app.update_template_context(context)
+    stream = current_app.jinja_env.get_template(template_name).stream(context)
+    # 每渲染 PROFILE_STREAM_CHUNK 段内容发送一次
+    stream.enable_buffering(current_app.config['PROFILE_STREAM_CHUNK'])
+    return stream
+
+
+@user.route('/feed')
+@login_required
+def feed():
+    '''当前用户关注的人发布的博客'''
+    blogs = current_user.feed()
+    return render_template('user/feed.html', blogs=blogs)
 
 
 @user.route('/edit-profile', methods=['GET', 'POST'])
@@ -130,6 +185,7 @@ def change_email():
 
 #  这里的token generate 相关需要clarify一下
 @user.route('/change-email/<token>')
+@primary_required
 @login_required
 def confirm_change_email(token):
     if current_user.confirm_user(token):
@@ -142,6 +198,7 @@ def confirm_change_email(token):
 
 
 @user.route('/follow/<name>')
+@primary_required
 @login_required
 def follow(name):
     '''关注用户'''
@@ -153,11 +210,13 @@ def follow(name):
         flash('在此操作之前，你已经关注了该用户。', 'info')
     else:
         current_user.follow(user)
+        relations.forget(current_user)
         flash('成功关注此用户。', 'success')
     return redirect(url_for('.index', name=name))
 
 
 @user.route('/unfollow/<name>')
+@primary_required
 @login_required
 def unfollow(name):
     '''取关用户'''
@@ -169,6 +228,7 @@ def unfollow(name):
         flash('你并未关注此用户。', 'info')
     else:
         current_user.unfollow(user)
+        relations.forget(current_user)
         flash('成功取关此用户。', 'success')
     return redirect(url_for('.index', name=name))
 
@@ -179,14 +239,14 @@ def followed(name):
     if not user:
         flash('用户不存在。', 'warning')
         return redirect(url_for('front.index'))
-    page = request.args.get('page', default=1, type=int)
-    pagination = user.followed.paginate(
-            page,
-            per_page = current_app.config['USERS_PER_PAGE'],
-            error_out = False
-    )
+    pagination = paginate(user.followed, (Follow.time_stamp, Follow.followed_id),
+                          per_page=current_app.config['USERS_PER_PAGE'])
     follows = [{'user': f.followed, 'time_stamp': f.time_stamp}
             for f in pagination.items]
+    # 一条查询得到当前用户与列表中所有用户的关注关系
+    states = relations.resolve(current_user, [f['user'] for f in follows])
+    for f in follows:
+        f['relation'] = states[f['user'].id]
     # 这个模板是「关注了哪些用户」和「被哪些用户关注了」共用的模板
     return render_template('user/follow.html', user=user, title='我关注的人',
             endpoint='user.followed', pagination=pagination, follows=follows)
@@ -199,14 +259,13 @@ def followers(name):
     if not user:
         flash('用户不存在。', 'warning')
         return redirect(url_for('front.index'))
-    page = request.args.get('page', default=1, type=int)
-    pagination = user.followers.paginate(
-            page,
-            per_page = current_app.config['USERS_PER_PAGE'],
-            error_out = False
-    )
+    pagination = paginate(user.followers, (Follow.time_stamp, Follow.follower_id),
+                          per_page=current_app.config['USERS_PER_PAGE'])
     follows = [{'user': f.follower, 'time_stamp': f.time_stamp}
             for f in pagination.items]
+    states = relations.resolve(current_user, [f['user'] for f in follows])
+    for f in follows:
+        f['relation'] = states[f['user'].id]
     return render_template('user/follow.html', user=user, title='关注我的人',
             endpoint='user.followers', pagination=pagination, follows=follows)
 
@@ -220,6 +279,7 @@ def edit_blog(id):
     if form.validate_on_submit():
         form.populate_obj(blog)
         db.session.add(blog)
+        Timeline.fan_out(blog)
         db.session.commit()
         flash('博客已经更新', 'success')
         return redirect(url_for('front.blog', id=blog.id))
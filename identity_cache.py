@@ -0,0 +1,116 @@
+'''
+Flask-Login 的用户加载缓存
+
+已登录用户的每个请求都要根据 session 中的用户 ID 加载 User 实例。
+这里把请求常用的列缓存在内存中（LRU + 过期时间），命中时直接构造
+已持久化状态的 User 实例并放入数据库会话，不执行查询。
+其余的列在第一次访问时才从数据库加载，视图函数修改实例后照常提交即可。
+用户数据被修改时（编辑资料、修改密码或邮箱、更换角色等）缓存随之失效。
+'''
+import time
+from collections import OrderedDict
+from threading import Lock
+
+from sqlalchemy.orm import make_transient_to_detached, object_session
+
+from models import db, User
+
+# 缓存的属性，大部分请求只用到这些
+# 不缓存计数列：发表博客、重新统计等操作用 Core 的 UPDATE 修改计数，不经过 User 的事件，
+# 缓存的旧值合并进会话后会覆盖查询结果，例如个人主页显示旧的博客数
+CACHED_ATTRIBUTES = ('id', 'name', 'email', '_password', 'confirmed',
+                     'role_id', 'avatar_hash', 'small_avatar_hash', 'gender',
+                     'last_seen')
+
+
+class IdentityCache:
+    '''带过期时间的 LRU 缓存，键为用户 ID ，值为属性字典'''
+
+    def __init__(self, maxsize=10000, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def init_app(self, app):
+        app.config.setdefault('IDENTITY_CACHE_SIZE', 10000)
+        app.config.setdefault('IDENTITY_CACHE_TTL', 60)
+        self.maxsize = app.config['IDENTITY_CACHE_SIZE']
+        self.ttl = app.config['IDENTITY_CACHE_TTL']
+
+    def get(self, user_id):
+        with self._lock:
+            item = self._data.get(user_id)
+            if item is None:
+                return None
+            expires, values = item
+            if expires < time.monotonic():
+                del self._data[user_id]
+                return None
+            self._data.move_to_end(user_id)
+            return values
+
+    def set(self, user_id, values):
+        with self._lock:
+            self._data[user_id] = (time.monotonic() + self.ttl, values)
+            self._data.move_to_end(user_id)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._data.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+user_cache = IdentityCache()
+
+
+def load_user(user_id):
+    '''Flask-Login 的 user_loader ，优先读取缓存'''
+    user_id = int(user_id)
+    values = user_cache.get(user_id)
+    if values is None:
+        user = User.query.get(user_id)
+        if user is not None:
+            user_cache.set(user_id, {key: getattr(user, key)
+                                     for key in CACHED_ATTRIBUTES})
+        return user
+    # 不调用 User.__init__ ，直接创建实例并填入缓存的属性
+    user = User.__mapper__.class_manager.new_instance()
+    for key, value in values.items():
+        setattr(user, key, value)
+    # 清除属性的修改记录，令其与刚从数据库查询出来的实例一样
+    make_transient_to_detached(user)
+    return db.session.merge(user, load=False)
+
+
+def on_user_updated(mapper, connection, target):
+    session = object_session(target)
+    # 发表博客或评论时作者实例也会被标记为已修改，只有列的值变化时才失效
+    if session is None or session.is_modified(target, include_collections=False):
+        forget(session, target.id)
+
+
+def on_user_deleted(mapper, connection, target):
+    forget(object_session(target), target.id)
+
+
+def forget(session, user_id):
+    '''立即删除缓存，并在事务提交后再删除一次，以免其间被旧数据填充'''
+    user_cache.invalidate(user_id)
+    if session is not None:
+        session.info.setdefault('stale_users', set()).add(user_id)
+
+
+def on_committed(session):
+    for user_id in session.info.pop('stale_users', ()):
+        user_cache.invalidate(user_id)
+
+
+db.event.listen(User, 'after_update', on_user_updated)
+db.event.listen(User, 'after_delete', on_user_deleted)
+db.event.listen(db.session, 'after_commit', on_committed)
@@ -0,0 +1,100 @@
+'''
+合并写入用户的最近活跃时间（last_seen）
+
+原来每个已登录用户的请求都会执行一次 UPDATE 并提交事务。
+这里先把每个用户最新的时间记在内存里，攒够 LAST_SEEN_FLUSH_SIZE 个用户
+或距上次写入超过 LAST_SEEN_FLUSH_INTERVAL 秒后，用一条 UPDATE 批量写入，
+进程退出时也会写入一次。页面上显示的活跃时间用 last_seen(user) 读取，
+先查内存中尚未写入的时间，不会落后一个写入周期。
+'''
+import atexit
+import time
+from datetime import datetime
+from threading import Lock, Thread, Event
+
+from sqlalchemy import case
+
+from models import db, User
+
+
+class LastSeenTracker:
+    '''在内存中合并 last_seen 更新并定期批量写入的扩展'''
+
+    def __init__(self, app=None):
+        self.app = None
+        self._pending = {}  # 用户 ID -> 最近活跃时间
+        self._lock = Lock()
+        self._last_flush = time.monotonic()
+        self._thread = None
+        self._stopped = Event()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('LAST_SEEN_FLUSH_INTERVAL', 60)
+        app.config.setdefault('LAST_SEEN_FLUSH_SIZE', 500)
+        self.app = app
+        app.extensions['last_seen'] = self
+        app.add_template_global(self.last_seen)
+        atexit.register(self.stop)
+
+    @property
+    def interval(self):
+        return self.app.config['LAST_SEEN_FLUSH_INTERVAL']
+
+    def touch(self, user_id, when=None):
+        '''记录用户的活跃时间，必要时立即批量写入'''
+        with self._lock:
+            self._pending[user_id] = when or datetime.utcnow()
+            due = (len(self._pending) >= self.app.config['LAST_SEEN_FLUSH_SIZE']
+                   or time.monotonic() - self._last_flush >= self.interval)
+        if due:
+            self.flush()
+        elif self._thread is None:
+            self._start()
+
+    def get(self, user_id):
+        '''尚未写入数据库的活跃时间，没有则返回 None'''
+        return self._pending.get(user_id)
+
+    def last_seen(self, user):
+        '''user 的最近活跃时间，包括尚未写入数据库的'''
+        return self.get(user.id) or user.last_seen
+
+    def flush(self):
+        '''把内存中的活跃时间用一条 UPDATE 语句写入数据库'''
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._last_flush = time.monotonic()
+        if not pending:
+            return
+        table = User.__table__
+        statement = table.update().where(table.c.id.in_(list(pending))).values(
+            last_seen=case(pending, value=table.c.id))
+        try:
+            with self.app.app_context():
+                with db.engine.begin() as conn:
+                    conn.execute(statement)
+        except Exception:
+            self.app.logger.exception('写入 last_seen 失败')
+            # 写入失败时放回内存，下次再试，已有更新的时间则保留新的
+            with self._lock:
+                for user_id, when in pending.items():
+                    self._pending.setdefault(user_id, when)
+
+    def _start(self):
+        '''启动后台线程，保证没有新请求时也能按时写入'''
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.flush()
+
+    def stop(self):
+        '''进程退出时写入剩余的数据'''
+        self._stopped.set()
+        self.flush()
@@ -0,0 +1,179 @@
+'''
+请求性能统计
+
+每个请求记录：SQL 语句数量和总耗时、模板渲染耗时、
+Blog.on_changed_body 和 send_email 的耗时（用 timed 上下文管理器统计）。
+按视图函数汇总为直方图，由 /admin/metrics 以 Prometheus 文本格式输出。
+耗时超过 METRICS_SLOW_REQUEST 秒的请求会在日志中记录最慢的几条 SQL 语句。
+'''
+import time
+from contextlib import contextmanager
+from threading import Lock
+
+from flask import g, request, has_request_context, current_app
+from flask.signals import signals_available, before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+
+# 指标名称 -> (说明, 直方图的分段)
+HISTOGRAMS = {
+    'request_duration_seconds': ('请求处理总耗时', BUCKETS),
+    'sql_duration_seconds': ('每个请求执行 SQL 的总耗时', BUCKETS),
+    'sql_statements': ('每个请求执行的 SQL 语句数量', COUNT_BUCKETS),
+    'template_duration_seconds': ('每个请求渲染模板的总耗时', BUCKETS),
+    'markdown_duration_seconds': ('每个请求渲染 Markdown 的总耗时', BUCKETS),
+    'email_duration_seconds': ('每个请求准备邮件的总耗时', BUCKETS),
+}
+
+
+class Histogram:
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+
+@contextmanager
+def timed(name):
+    '''统计代码块的耗时，计入当前请求的 name 项，例如 timed('markdown')'''
+    if not has_request_context():
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings = g.setdefault('metrics_timings', {})
+        timings[name] = timings.get(name, 0) + time.perf_counter() - start
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def before_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context():
+        g.setdefault('metrics_sql_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def after_execute(conn, cursor, statement, parameters, context, executemany):
+    if not has_request_context() or not g.get('metrics_sql_started'):
+        return
+    elapsed = time.perf_counter() - g.metrics_sql_started.pop()
+    g.metrics_sql_count = g.get('metrics_sql_count', 0) + 1
+    g.metrics_sql_time = g.get('metrics_sql_time', 0) + elapsed
+    # 只保留最慢的几条语句
+    slowest = g.setdefault('metrics_slow_queries', [])
+    slowest.append((elapsed, statement))
+    if len(slowest) > 20:
+        slowest.sort(reverse=True)
+        del slowest[10:]
+
+
+def on_before_render(app, template, context, **extra):
+    g.setdefault('metrics_render_started', []).append(time.perf_counter())
+
+
+def on_rendered(app, template, context, **extra):
+    if g.get('metrics_render_started'):
+        elapsed = time.perf_counter() - g.metrics_render_started.pop()
+        # 嵌套渲染（例如页面片段）只计入最外层
+        if not g.metrics_render_started:
+            g.metrics_template_time = g.get('metrics_template_time', 0) + elapsed
+
+
+class Metrics:
+    '''按视图函数汇总请求性能数据的扩展'''
+
+    def __init__(self, app=None):
+        self._histograms = {}  # (指标名称, 视图函数) -> Histogram
+        self._lock = Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('METRICS_SLOW_REQUEST', 1.0)
+        app.config.setdefault('METRICS_SLOW_QUERIES', 5)
+        app.extensions['metrics'] = self
+        app.before_request(self.start)
+        app.after_request(self.record)
+        # Flask 的信号需要安装 blinker ，没有安装时不统计模板渲染耗时
+        if signals_available:
+            before_render_template.connect(on_before_render, app)
+            template_rendered.connect(on_rendered, app)
+
+    @staticmethod
+    def start():
+        g.metrics_started = time.perf_counter()
+
+    def record(self, response):
+        started = g.get('metrics_started')
+        if started is None:
+            return response
+        duration = time.perf_counter() - started
+        endpoint = request.endpoint or 'unknown'
+        timings = g.get('metrics_timings', {})
+        values = {
+            'request_duration_seconds': duration,
+            'sql_duration_seconds': g.get('metrics_sql_time', 0),
+            'sql_statements': g.get('metrics_sql_count', 0),
+            'template_duration_seconds': g.get('metrics_template_time', 0),
+            'markdown_duration_seconds': timings.get('markdown', 0),
+            'email_duration_seconds': timings.get('email', 0),
+        }
+        with self._lock:
+            for name, value in values.items():
+                key = (name, endpoint)
+                if key not in self._histograms:
+                    self._histograms[key] = Histogram(HISTOGRAMS[name][1])
+                self._histograms[key].observe(value)
+        if duration > current_app.config['METRICS_SLOW_REQUEST']:
+            self.log_slow_request(endpoint, duration)
+        return response
+
+    @staticmethod
+    def log_slow_request(endpoint, duration):
+        slowest = sorted(g.get('metrics_slow_queries', []), reverse=True)
+        slowest = slowest[:current_app.config['METRICS_SLOW_QUERIES']]
+        current_app.logger.warning(
+            '慢请求 %s %s 用时 %.3f 秒，%d 条 SQL 共 %.3f 秒，最慢的语句：\n%s',
+            endpoint, request.full_path, duration, g.get('metrics_sql_count', 0),
+            g.get('metrics_sql_time', 0),
+            '\n'.join('{:.3f}s {}'.format(t, s) for t, s in slowest))
+
+    def prometheus(self, extra=None):
+        '''以 Prometheus 文本格式输出所有直方图，extra 为其它计数器 {名称: 值}'''
+        lines = []
+        with self._lock:
+            items = sorted(self._histograms.items())
+            for name, (help_text, _) in HISTOGRAMS.items():
+                metric = 'flaska_' + name
+                lines.append('# HELP {} {}'.format(metric, help_text))
+                lines.append('# TYPE {} histogram'.format(metric))
+                for (key, endpoint), histogram in items:
+                    if key != name:
+                        continue
+                    label = 'endpoint="{}"'.format(endpoint)
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        lines.append('{}_bucket{{{},le="{}"}} {}'.format(
+                            metric, label, bound, count))
+                    lines.append('{}_bucket{{{},le="+Inf"}} {}'.format(
+                        metric, label, histogram.count))
+                    lines.append('{}_sum{{{}}} {}'.format(
+                        metric, label, histogram.sum))
+                    lines.append('{}_count{{{}}} {}'.format(
+                        metric, label, histogram.count))
+        for name, value in (extra or {}).items():
+            lines.append('# TYPE flaska_{} counter'.format(name))
+            lines.append('flaska_{} {}'.format(name, value))
+        return '\n'.join(lines) + '\n'
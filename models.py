@@ -1,16 +1,22 @@
-from flask_sqlalchemy import SQLAlchemy
-from werkzeug.security import generate_password_hash, check_password_hash
 from itsdangerous import TimedJSONWebSignatureSerializer as Serializer
 from itsdangerous import BadSignature
 from datetime import datetime
+from collections import namedtuple
 import enum
+import time
 
 import hashlib
 from flask_login import UserMixin
 from flask import current_app
 
-import bleach
-from markdown import markdown
+from flask import has_app_context
+from sqlalchemy import func
+from sqlalchemy.orm import joinedload, object_session
+
+from rendering import render_markdown, is_cached, background_renderer
+from passwords import hasher
+from replicas import RoutingSQLAlchemy
+from metrics import timed
 
 # UserMixin 是在 flask_login.mixins 模块中定义的类
 # 该类为 User 类的实例增加了 is_authenticated、is_active、is_anonymous 等属性
@@ -22,7 +28,8 @@ from markdown import markdown
 #
 # User 类的实例的 get_id 的返回值为 str(self.id) ，即 id 属性值的字符串
 
-db = SQLAlchemy()
+# GET 请求的查询发送到只读副本，见 replicas.py
+db = RoutingSQLAlchemy()
 
 
 class Permission:
@@ -43,15 +50,60 @@ class Gender(enum.Enum):
     UNKNOWN = 'I am not sure'
 
 
+# 缓存在内存中的角色信息
+RoleInfo = namedtuple('RoleInfo', 'id name permissions default')
+
+
 class Role(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(64), unique=True)
     default = db.Column(db.Boolean, default=False, index=True)
     permissions = db.Column(db.Integer)
 
+    # 角色数据表几乎不会变化，整个进程共用一份 {id: RoleInfo} 缓存
+    # 第一次使用时加载，insert_roles 等修改角色的操作会使其失效
+    # 其它进程修改角色后，最多 ROLE_CACHE_TTL 秒后重新加载
+    _cache = None
+    _cache_loaded_at = 0
+
     def __repr__(self):
         return '<Role: {}>'.format(self.name)
 
+    @staticmethod
+    def cached():
+        '''返回缓存的角色字典，过期或失效时重新加载'''
+        ttl = (current_app.config.get('ROLE_CACHE_TTL')
+               if has_app_context() else None)
+        if Role._cache is None or (
+                ttl and time.monotonic() - Role._cache_loaded_at > ttl):
+            Role.load_cache()
+        return Role._cache
+
+    @staticmethod
+    def load_cache():
+        rows = db.session.query(Role.id, Role.name, Role.permissions,
+                                Role.default)
+        Role._cache = {row.id: RoleInfo(row.id, row.name, row.permissions or 0,
+                                        bool(row.default)) for row in rows}
+        Role._cache_loaded_at = time.monotonic()
+
+    @staticmethod
+    def invalidate_cache():
+        Role._cache = None
+
+    @staticmethod
+    def permissions_of(role_id):
+        '''查询角色拥有的权限，不存在的角色没有任何权限'''
+        info = Role.cached().get(role_id)
+        return info.permissions if info else 0
+
+    @staticmethod
+    def default_id():
+        '''新用户的默认角色的 id'''
+        for info in Role.cached().values():
+            if info.default:
+                return info.id
+
     @staticmethod
     def insert_roles():
         roles = {
@@ -73,6 +125,7 @@ class Role(db.Model):
             role.default = True if role.name == default_role_name else False
             db.session.add(role)
         db.session.commit()
+        Role.invalidate_cache()
         print('角色已创建')
 
 
@@ -86,6 +139,26 @@ class Follow(db.Model):
     followed_id = db.Column(db.Integer, db.ForeignKey('user.id'),
                             primary_key=True)  # 被关注者 ID
     time_stamp = db.Column(db.DateTime, default=datetime.now)
+    # 关注列表和粉丝列表按 (time_stamp, 对方 ID) 分页，索引同时用于过滤和排序
+    __table_args__ = (
+        db.Index('ix_follows_follower_time', 'follower_id', 'time_stamp',
+                 'followed_id'),
+        db.Index('ix_follows_followed_time', 'followed_id', 'time_stamp',
+                 'follower_id'),
+    )
+
+    @staticmethod
+    def on_inserted(mapper, connection, target):
+        User.increase(connection, target.follower_id, 'followed_count', 1)
+        User.gain_follower(connection, target.followed_id)
+        Suggestion.discard(connection, target.follower_id, target.followed_id)
+        Suggestion.mark_stale(connection, target.follower_id)
+
+    @staticmethod
+    def on_deleted(mapper, connection, target):
+        User.increase(connection, target.follower_id, 'followed_count', -1)
+        User.increase(connection, target.followed_id, 'followers_count', -1)
+        Suggestion.mark_stale(connection, target.follower_id)
 
 
 class User(db.Model, UserMixin):
@@ -94,7 +167,8 @@ class User(db.Model, UserMixin):
         '''default role'''
         # inherit the core of ORM
         super().__init__(**kw)
-        self.role = Role.query.filter_by(default=True).first()
+        if self.role is None and self.role_id is None:
+            self.role_id = Role.default_id()
 
     # necessary
     id = db.Column(db.Integer, primary_key=True)
@@ -120,6 +194,18 @@ class User(db.Model, UserMixin):
     create_at = db.Column(db.DateTime, default=datetime.utcnow())
     last_seen = db.Column(db.DateTime, default=datetime.utcnow())
 
+    # 冗余计数，由 Follow 和 Blog 的事件监听程序原子地加减
+    # 数据不一致时可以用 flask reconcile-counters 命令重新统计
+    followers_count = db.Column(db.Integer, default=0, server_default='0')
+    followed_count = db.Column(db.Integer, default=0, server_default='0')
+    blogs_count = db.Column(db.Integer, default=0, server_default='0')
+    # 粉丝数超过 TIMELINE_FANOUT_THRESHOLD 后置为 True 且不再改回，
+    # 之后的博客不推送到时间线，读取关注动态时再合并，见 Timeline.feed
+    fanout_on_read = db.Column(db.Boolean, default=False, server_default='0')
+    # 资料（用户名、邮箱、头像等）的最后修改时间，用于生成 ETag / Last-Modified
+    # 计数和 last_seen 的变化不算，见 User.on_updating
+    updated_at = db.Column(db.DateTime, index=True, default=datetime.now)
+
     # getter
     @property
     def password(self):
@@ -154,32 +240,37 @@ class User(db.Model, UserMixin):
         db.session.commit()  # complete update
         return True
 
+    # 权限判断都读取 Role 的内存缓存，不会查询 role 数据表
     @property
     def is_administrator(self):
-        return self.role.permissions & Permission.ADMINISTER
+        return self.has_permission(Permission.ADMINISTER)
 
     @property
     def is_moderator(self):
-        return self.role.permissions & Permission.MODERATE
+        return self.has_permission(Permission.MODERATE)
 
     @property
     def can_follow(self):
-        return self.role.permissions & Permission.FOLLOW
+        return self.has_permission(Permission.FOLLOW)
 
     def has_permission(self, permission):
-        return self.role.permissions & permission
+        return Role.permissions_of(self.role_id) & permission
 
     # 为了修复 user\index permission问题做的一个替换has-permission的方法
     def has_permission_replace(self, permission):
-        replace_table = {1: 7, 2: 15, 3: 143}
-        return replace_table.get(self.role_id) & permission
+        return self.has_permission(permission)
 
+    # 哈希计算在进程池中执行，见 passwords.py
     @password.setter
     def password(self, pwd):  # 创建实例时自动运行并赋值给_password
-        self._password = generate_password_hash(pwd)
+        self._password = hasher.hash(pwd)
 
     def verify_password(self, pwd):
-        return check_password_hash(self._password, pwd)
+        return hasher.verify(self._password, pwd)
+
+    def password_needs_rehash(self):
+        '''密码哈希使用的算法参数是否已过时'''
+        return hasher.needs_rehash(self._password)
 
     def ping(self):
         self.last_seen = datetime.utcnow()
@@ -259,6 +350,8 @@ class User(db.Model, UserMixin):
         if not self.is_following(user):
             f = Follow(follower_id=self.id, followed_id=user.id)
             db.session.add(f)
+            # 把 user 最近的博客补进 self 的时间线
+            Timeline.backfill(self, user)
             db.session.commit()
 
     def unfollow(self, user):
@@ -266,6 +359,8 @@ class User(db.Model, UserMixin):
         f = self.followed.filter_by(followed_id=user.id).first()
         if f:
             db.session.delete(f)
+            # 从 self 的时间线中移除 user 的博客
+            Timeline.prune(self, user)
             db.session.commit()
 
     # all blogs the user followed
@@ -273,6 +368,10 @@ class User(db.Model, UserMixin):
     def followed_posts(self):
         return Blog.query.join(Follow, Follow.followed_id == Blog.author_id).filter(Follow.follower_id == self.id)
 
+    def feed(self, limit=None):
+        '''读取预先计算好的关注动态，见 Timeline.feed'''
+        return Timeline.feed(self, limit)
+
     # join是连表查询， 查询 Follow， 条件是 followed-id，筛选条件是follower—id
 
     # 需要新建一个column管理小图片，自动调整没有反应 (解决）
@@ -280,18 +379,88 @@ class User(db.Model, UserMixin):
     def __repr__(self):
         return '<User: {}>'.format(self.name)
 
+    @staticmethod
+    def increase(connection, user_id, column, delta):
+        '''在数据库中原子地加减 user_id 用户的计数列'''
+        table = User.__table__
+        connection.execute(table.update().where(table.c.id == user_id)
+                           .values({column: table.c[column] + delta}))
+
+    # 这些列的变化不影响其他页面上显示的用户信息
+    VOLATILE_COLUMNS = ('last_seen', 'followers_count', 'followed_count',
+                        'blogs_count', 'fanout_on_read', 'updated_at')
+
+    @staticmethod
+    def on_updating(mapper, connection, target):
+        '''通过 ORM 修改资料时更新 updated_at ，计数等用 Core 修改的列不会触发'''
+        state = db.inspect(target)
+        for column in mapper.column_attrs:
+            if (column.key not in User.VOLATILE_COLUMNS and
+                    state.attrs[column.key].history.has_changes()):
+                target.updated_at = datetime.now()
+                return
+
+    @staticmethod
+    def gain_follower(connection, user_id):
+        '''粉丝数加一，超过阈值时同时设置 fanout_on_read ，只需一条 UPDATE'''
+        table = User.__table__
+        threshold = current_app.config['TIMELINE_FANOUT_THRESHOLD']
+        # 先给 fanout_on_read 赋值：MySQL 按顺序执行赋值，这里读到的仍是原来的粉丝数
+        connection.execute(
+            table.update(preserve_parameter_order=True)
+            .where(table.c.id == user_id)
+            .values([(table.c.fanout_on_read,
+                      db.or_(table.c.fanout_on_read == True,
+                             table.c.followers_count >= threshold)),
+                     (table.c.followers_count, table.c.followers_count + 1)]))
+
+    @staticmethod
+    def mark_popular():
+        '''重新统计计数之后，把粉丝数超过阈值的用户改为读取时合并'''
+        table = User.__table__
+        threshold = current_app.config['TIMELINE_FANOUT_THRESHOLD']
+        db.session.execute(table.update()
+                           .where(table.c.followers_count > threshold)
+                           .values(fanout_on_read=True))
+
+    @staticmethod
+    def reconcile_counters():
+        '''按 follows 、blog 和 blog_archive 数据表重新统计所有用户的计数列'''
+        users = User.__table__
+        follows = Follow.__table__
+        blogs = Blog.__table__
+
+        def count(table, column):
+            return (db.select([func.count()]).select_from(table)
+                    .where(column == users.c.id).as_scalar())
+
+        archived = ArchivedBlog.__table__
+        # 归档的博客仍然显示在个人主页上，也计入博客数
+        db.session.execute(users.update().values(
+            followers_count=count(follows, follows.c.followed_id),
+            followed_count=count(follows, follows.c.follower_id),
+            blogs_count=count(blogs, blogs.c.author_id) +
+            count(archived, archived.c.author_id)))
+        User.mark_popular()
+        db.session.commit()
+
     def change_admin(self):
         f = Role.query.filter_by(id=3).first()
         self.role=f
         db.session.add(self)
         db.session.commit()
+        Role.invalidate_cache()
 
 class Comment(db.Model):
     '''评论映射类'''
+    archived = False  # 见 ArchivedComment
 
     id = db.Column(db.Integer, primary_key=True)
     body = db.Column(db.Text)
     time_stamp = db.Column(db.DateTime, index=True, default=datetime.now)
+    # 最后修改时间（包括封禁状态），用于生成 ETag / Last-Modified
+    updated_at = db.Column(db.DateTime, index=True, default=datetime.now,
+                           onupdate=datetime.now)
     disable = db.Column(db.Boolean)
     author_id = db.Column(db.Integer,
                           db.ForeignKey('user.id', ondelete='CASCADE'))
@@ -301,44 +470,394 @@ class Comment(db.Model):
                         db.ForeignKey('blog.id', ondelete='CASCADE'))
     blog = db.relationship('Blog', backref=db.backref('comments',
                                                       lazy='dynamic', cascade='all, delete-orphan'))
+    # 博客页面的评论按 (time_stamp, id) 分页
+    __table_args__ = (
+        db.Index('ix_comment_blog_time', 'blog_id', 'time_stamp', 'id'),
+    )
+
+    @staticmethod
+    def with_authors(query):
+        '''列表查询一次性加载评论者'''
+        return query.options(joinedload(Comment.author))
 
 
 class Blog(db.Model):
     '''Blog ORM'''
+    archived = False  # 见 ArchivedBlog
+
     id = db.Column(db.Integer, primary_key=True)
     body = db.Column(db.Text)
     body_html = db.Column(db.Text)
     time_stamp = db.Column(db.DateTime, default=datetime.now)
+    # 最后修改时间，后台渲染写入 body_html 时也会更新
+    updated_at = db.Column(db.DateTime, index=True, default=datetime.now,
+                           onupdate=datetime.now)
     author_id = db.Column(db.Integer,
                           db.ForeignKey('user.id', ondelete='CASCADE'))
     author = db.relationship('User', backref=db.backref('blogs', lazy='dynamic',
                                                         cascade='all, delete-orphan'))
+    # 首页按 (time_stamp, id) 分页，个人主页再加上作者过滤
+    __table_args__ = (
+        db.Index('ix_blog_time', 'time_stamp', 'id'),
+        db.Index('ix_blog_author_time', 'author_id', 'time_stamp', 'id'),
+    )
     '''author(relationship) 是基于 foreignkey而存在的!,没有 foreignkey 就不可能relationship
     author 可以直接在front 内被赋值 current user
     再id, time, author_id自动生成，body_html通过静态方法监听更改，body 通过form 更改
     '''
 
+    @staticmethod
+    def with_authors(query):
+        '''列表查询一次性加载作者，避免渲染每条博客时再查询'''
+        # 权限判断读取 Role 的缓存，不再需要连表加载作者的角色
+        return query.options(joinedload(Blog.author))
+
     # 该方法为静态方法，可以写在类外部，Blog().body 有变化时自动运行
     # target 为 Blog 类的实例，value 为实例的 body 属性值
-    # old_value 为数据库中 Blog.body_html 的值，initiator 是一个事件对象
-    # 后两个参数为事件监听程序调用此函数时固定要传入的值，在函数内部用不到
+    # old_value 为数据库中 Blog.body 原来的值，initiator 是一个事件对象
     @staticmethod
     def on_changed_body(target, value, old_value, initiator):
-        allowed_tags = ['a', 'abbr', 'acronym', 'b', 'blockquote', 'code',
-                        'em', 'i', 'li', 'ol', 'pre', 'strong', 'ul',
-                        'h1', 'h2', 'h3', 'p']
-        # bleach.linkify 方法将 <a> 标签转换为链接
-        # bleach.clean 方法清洗 HTML 数据
-        # markdown 方法将 Markdown 文本转换为 HTML
-        target.body_html = bleach.linkify(bleach.clean(markdown(value, output_format='html'),
-                                                       tags=allowed_tags, strip=True))
+        # 正文没有变化（例如原样提交编辑表单）时不需要重新渲染
+        if value == old_value:
+            return
+        if value is None:
+            target.body_html = None
+            return
+        threshold = (current_app.config.get('RENDER_ASYNC_THRESHOLD')
+                     if has_app_context() else None)
+        if threshold and len(value) > threshold and not is_cached(value):
+            # 较长的博客先不渲染，提交事务后交给后台线程处理
+            # 渲染完成之前页面显示原始的 Markdown 文本
+            target.body_html = None
+            target._render_later = True
+        else:
+            with timed('markdown'):
+                target.body_html = render_markdown(value)
+
+    @staticmethod
+    def on_inserted(mapper, connection, target):
+        User.increase(connection, target.author_id, 'blogs_count', 1)
+
+    @staticmethod
+    def on_deleted(mapper, connection, target):
+        User.increase(connection, target.author_id, 'blogs_count', -1)
+
+    @staticmethod
+    def on_flushed(mapper, connection, target):
+        '''博客写入数据库后才有 id ，此时登记需要后台渲染的博客'''
+        if getattr(target, '_render_later', False):
+            del target._render_later
+            session = object_session(target)
+            session.info.setdefault('blog_renders', []).append(
+                (target.id, target.body))
+
+    @staticmethod
+    def on_committed(session):
+        '''事务提交后再提交后台渲染任务，保证任务能读到这篇博客'''
+        renders = session.info.pop('blog_renders', None)
+        if renders and has_app_context():
+            app = current_app._get_current_object()
+            for blog_id, body in renders:
+                background_renderer.submit(Blog.render_later, app, blog_id, body)
+
+    @staticmethod
+    def on_rolled_back(session):
+        session.info.pop('blog_renders', None)
+
+    @staticmethod
+    def render_later(app, blog_id, body):
+        '''在后台线程中渲染博客，正文在此期间被修改过的话就放弃写入'''
+        html = render_markdown(body)
+        table = Blog.__table__
+        with app.app_context():
+            with db.engine.begin() as conn:
+                conn.execute(table.update()
+                             .where(table.c.id == blog_id)
+                             .where(table.c.body == body)
+                             .values(body_html=html))
+
+
+
+
+class Timeline(db.Model):
+    '''物化的关注动态（时间线），发布博客时推送到每个关注者名下'''
+
+    __tablename__ = 'timelines'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'),
+                        primary_key=True)  # 时间线的主人，即关注者 ID
+    blog_id = db.Column(db.Integer, db.ForeignKey('blog.id', ondelete='CASCADE'),
+                        primary_key=True)
+    author_id = db.Column(db.Integer, index=True)  # 冗余存储，取关时按作者删除
+    time_stamp = db.Column(db.DateTime, index=True)  # 与 Blog.time_stamp 一致
+    __table_args__ = (db.Index('ix_timelines_user_time', 'user_id', 'time_stamp'),)
+
+    @staticmethod
+    def is_popular(author):
+        '''
+        热门作者不做推送，读取时再合并（fan-out-on-read）
+        使用不会改回的 fanout_on_read 而不是实时的粉丝数，
+        粉丝数在阈值附近变化时博客既不会重复，也不会从关注动态中消失
+        '''
+        return bool(author.fanout_on_read)
+
+    @staticmethod
+    def fan_out(blog):
+        '''把 blog 推送到作者所有关注者的时间线，重复推送不会产生重复数据'''
+        if Timeline.is_popular(blog.author):
+            return
+        follower_ids = [f.follower_id for f in
+                        Follow.query.filter_by(followed_id=blog.author_id)
+                        .with_entities(Follow.follower_id)]
+        if not follower_ids:
+            return
+        # 编辑博客时也会调用此方法，已推送过的关注者直接跳过
+        pushed = {t.user_id for t in Timeline.query
+                  .filter_by(blog_id=blog.id).with_entities(Timeline.user_id)}
+        rows = [dict(user_id=uid, blog_id=blog.id, author_id=blog.author_id,
+                     time_stamp=blog.time_stamp)
+                for uid in follower_ids if uid not in pushed]
+        if rows:
+            db.session.execute(Timeline.__table__.insert(), rows)
+
+    @staticmethod
+    def backfill(follower, followed):
+        '''关注新用户时，把其最近的博客补进关注者的时间线'''
+        if Timeline.is_popular(followed):
+            return
+        limit = current_app.config['TIMELINE_LENGTH']
+        blogs = (Blog.query.filter_by(author_id=followed.id)
+                 .order_by(Blog.time_stamp.desc()).limit(limit)
+                 .with_entities(Blog.id, Blog.time_stamp))
+        rows = [dict(user_id=follower.id, blog_id=b.id, author_id=followed.id,
+                     time_stamp=b.time_stamp) for b in blogs]
+        if rows:
+            # 以防万一先删除旧数据，避免主键冲突
+            Timeline.query.filter_by(user_id=follower.id,
+                                     author_id=followed.id).delete()
+            db.session.execute(Timeline.__table__.insert(), rows)
+        Timeline.trim(follower.id)
+
+    @staticmethod
+    def prune(follower, followed):
+        '''取关时，从关注者的时间线中删除被取关者的博客'''
+        Timeline.query.filter_by(user_id=follower.id,
+                                 author_id=followed.id).delete()
 
+    @staticmethod
+    def trim(user_id):
+        '''时间线只保留最新的 TIMELINE_LENGTH 条'''
+        limit = current_app.config['TIMELINE_LENGTH']
+        oldest = (Timeline.query.filter_by(user_id=user_id)
+                  .order_by(Timeline.time_stamp.desc())
+                  .offset(limit).with_entities(Timeline.time_stamp).first())
+        if oldest:
+            Timeline.query.filter(Timeline.user_id == user_id,
+                                  Timeline.time_stamp <= oldest.time_stamp
+                                  ).delete(synchronize_session=False)
+
+    @staticmethod
+    def rebuild():
+        '''按 follows 和 blog 数据表重建所有时间线，用于批量导入数据之后'''
+        timelines = Timeline.__table__
+        follows = Follow.__table__
+        blogs = Blog.__table__
+        users = User.__table__
+        db.session.execute(timelines.delete())
+        # INSERT ... SELECT 在数据库内完成，不把数据读到应用中
+        rows = (db.select([follows.c.follower_id, blogs.c.id,
+                           blogs.c.author_id, blogs.c.time_stamp])
+                .select_from(follows.join(
+                    blogs, blogs.c.author_id == follows.c.followed_id)
+                    .join(users, users.c.id == blogs.c.author_id))
+                .where(db.or_(users.c.fanout_on_read.is_(None),
+                              users.c.fanout_on_read == False)))
+        db.session.execute(timelines.insert().from_select(
+            ['user_id', 'blog_id', 'author_id', 'time_stamp'], rows))
+        limit = current_app.config['TIMELINE_LENGTH']
+        overflow = (db.session.query(Timeline.user_id)
+                    .group_by(Timeline.user_id).having(func.count() > limit))
+        for row in overflow.all():
+            Timeline.trim(row.user_id)
+        db.session.commit()
+
+    @staticmethod
+    def feed(user, limit=None):
+        '''读取 user 的关注动态：物化的时间线 + 热门作者的最新博客'''
+        limit = limit or current_app.config['TIMELINE_LENGTH']
+        blogs = (Blog.with_authors(Blog.query)
+                 .join(Timeline, Timeline.blog_id == Blog.id)
+                 .filter(Timeline.user_id == user.id)
+                 .order_by(Timeline.time_stamp.desc()).limit(limit).all())
+        # 热门作者没有推送，在这里按需读取再合并
+        popular_ids = [row.id for row in db.session.query(User.id)
+                       .join(Follow, Follow.followed_id == User.id)
+                       .filter(Follow.follower_id == user.id,
+                               User.fanout_on_read == True)]
+        if popular_ids:
+            blogs += (Blog.with_authors(Blog.query)
+                      .filter(Blog.author_id.in_(popular_ids))
+                      .order_by(Blog.time_stamp.desc()).limit(limit).all())
+            # 作者成为热门之前推送的博客两边都有，按 id 去重
+            blogs = list({blog.id: blog for blog in blogs}.values())
+            blogs.sort(key=lambda b: (b.time_stamp, b.id), reverse=True)
+        return blogs[:limit]
+
+
+
+class Suggestion(db.Model):
+    '''“可能认识的人”，由 flask suggest-follows 命令离线计算，见 suggestions.py'''
+
+    __tablename__ = 'suggestions'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'),
+                        primary_key=True)  # 推荐给谁
+    suggested_id = db.Column(db.Integer,
+                             db.ForeignKey('user.id', ondelete='CASCADE'),
+                             primary_key=True)  # 推荐的用户
+    score = db.Column(db.Integer)  # user 关注的人中有多少个关注了 suggested
+    computed_at = db.Column(db.DateTime, default=datetime.now)
+    __table_args__ = (db.Index('ix_suggestions_user_score', 'user_id', 'score'),)
+
+    @staticmethod
+    def for_user(user, limit=None):
+        '''读取 user 的推荐和被推荐的用户，返回 [(Suggestion, User)]'''
+        limit = limit or current_app.config['SUGGESTIONS_ON_PROFILE']
+        return (db.session.query(Suggestion, User)
+                .join(User, User.id == Suggestion.suggested_id)
+                .filter(Suggestion.user_id == user.id)
+                # 离线计算期间刚关注的用户也不再推荐
+                .filter(~db.exists().where(db.and_(
+                    Follow.follower_id == user.id,
+                    Follow.followed_id == Suggestion.suggested_id)))
+                .order_by(Suggestion.score.desc(), Suggestion.suggested_id)
+                .limit(limit).all())
 
+    @staticmethod
+    def discard(connection, user_id, suggested_id):
+        '''关注之后立即从推荐中去掉被关注的用户'''
+        table = Suggestion.__table__
+        connection.execute(table.delete().where(db.and_(
+            table.c.user_id == user_id, table.c.suggested_id == suggested_id)))
+
+    @staticmethod
+    def mark_stale(connection, user_id):
+        '''
+        关注或取关时只标记关注者：被关注的人关注的用户没有变，推荐也不变
+        关注者的粉丝的二度关系也变了，由 flask suggest-follows 在内存中的关注图上找出
+        '''
+        connection.execute(StaleSuggestion.__table__.insert().values(
+            user_id=user_id))
+
+
+class StaleSuggestion(db.Model):
+    '''需要重新计算推荐的用户，同一个用户可能出现多次，计算完成后删除'''
+
+    __tablename__ = 'suggestion_stale'
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, index=True)
+
+class Outbox(db.Model):
+    '''待发送的邮件，由 email_app.MailWorkerPool 的工作线程读取并发送'''
+
+    id = db.Column(db.Integer, primary_key=True)
+    recipients = db.Column(db.Text)  # 多个收件人以逗号分隔
+    subject = db.Column(db.String(256))
+    sender = db.Column(db.String(128))
+    body = db.Column(db.Text)
+    html = db.Column(db.Text)
+    # pending 待发送，sending 发送中，sent 已发送，failed 重试次数用尽
+    status = db.Column(db.String(16), default='pending', index=True)
+    attempts = db.Column(db.Integer, default=0)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    claimed_by = db.Column(db.String(32), index=True)  # 领取该邮件的工作线程
+    claimed_at = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+    create_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime)
+
+    def __repr__(self):
+        return '<Outbox: {} {}>'.format(self.id, self.status)
 
 
+class SearchPosting(db.Model):
+    '''倒排索引：词项出现在哪些博客或评论中，以及出现的次数'''
+
+    __tablename__ = 'search_postings'
+
+    term = db.Column(db.String(64), primary_key=True)
+    doc_type = db.Column(db.String(1), primary_key=True)  # 'b' 博客，'c' 评论
+    doc_id = db.Column(db.Integer, primary_key=True)
+    tf = db.Column(db.Integer)  # 词频
+    __table_args__ = (db.Index('ix_search_postings_doc', 'doc_type', 'doc_id'),)
+
+
+class ArchivedBlog(db.Model):
+    '''
+    归档的旧博客，由 flask archive-blogs 命令从 blog 数据表移入，id 保持不变
+    博客页面和个人主页在 blog 数据表中找不到时读取此表，归档的博客只读
+    '''
+
+    __tablename__ = 'blog_archive'
+
+    archived = True
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    body = db.Column(db.Text)
+    body_html = db.Column(db.Text)
+    time_stamp = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime)
+    author_id = db.Column(db.Integer,
+                          db.ForeignKey('user.id', ondelete='CASCADE'))
+    author = db.relationship('User')
+    archived_at = db.Column(db.DateTime, default=datetime.now)
+    __table_args__ = (
+        db.Index('ix_blog_archive_author_time', 'author_id', 'time_stamp', 'id'),
+    )
+
+    @staticmethod
+    def with_authors(query):
+        return query.options(joinedload(ArchivedBlog.author))
+
+
+class ArchivedComment(db.Model):
+    '''归档的博客的评论，与博客一起归档'''
+
+    __tablename__ = 'comment_archive'
+
+    archived = True
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    body = db.Column(db.Text)
+    time_stamp = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime)
+    disable = db.Column(db.Boolean)
+    author_id = db.Column(db.Integer,
+                          db.ForeignKey('user.id', ondelete='CASCADE'))
+    author = db.relationship('User')
+    blog_id = db.Column(db.Integer, db.ForeignKey('blog_archive.id',
+                                                  ondelete='CASCADE'))
+    archived_at = db.Column(db.DateTime, default=datetime.now)
+    __table_args__ = (
+        db.Index('ix_comment_archive_blog_time', 'blog_id', 'time_stamp', 'id'),
+    )
+
+    @staticmethod
+    def with_authors(query):
+        return query.options(joinedload(ArchivedComment.author))
+
 
 # db.event.listen 设置 SQLAlchemy 的 'set' 事件监听程序
 # 当 Blog.body 的值发生变化，该事件监听程序会自动运行
 # 高效地修改 Blog.body_html 字段的值并存入数据表
 db.event.listen(Blog.body, 'set', Blog.on_changed_body)
-
+db.event.listen(Blog, 'after_insert', Blog.on_inserted)
+db.event.listen(Blog, 'after_delete', Blog.on_deleted)
+db.event.listen(Follow, 'after_insert', Follow.on_inserted)
+db.event.listen(Follow, 'after_delete', Follow.on_deleted)
+db.event.listen(User, 'before_update', User.on_updating)
+db.event.listen(Blog, 'after_insert', Blog.on_flushed)
+db.event.listen(Blog, 'after_update', Blog.on_flushed)
+db.event.listen(db.session, 'after_commit', Blog.on_committed)
+db.event.listen(db.session, 'after_rollback', Blog.on_rolled_back)
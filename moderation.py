@@ -0,0 +1,88 @@
+'''
+批量审核评论
+
+隐藏和恢复评论都只执行一条 UPDATE 语句，可以按评论 id 列表、作者或博客选择评论。
+删除某个作者的所有评论时每批删除 MODERATION_BATCH_SIZE 条并提交一次，
+每个事务只锁定一小批数据，不会长时间锁住 comment 数据表。
+
+这些操作不经过 ORM ，不会触发映射类的事件，
+所以在这里自己更新 updated_at 、搜索索引和页面缓存。
+'''
+from datetime import datetime
+
+from flask import current_app
+
+from models import db, Comment
+from page_cache import page_cache
+import search
+
+
+def criteria(ids=None, author_id=None, blog_id=None):
+    '''选择评论的条件，至少要提供一个'''
+    conditions = []
+    if ids:
+        conditions.append(Comment.id.in_(ids))
+    if author_id is not None:
+        conditions.append(Comment.author_id == author_id)
+    if blog_id is not None:
+        conditions.append(Comment.blog_id == blog_id)
+    if not conditions:
+        raise ValueError('至少需要提供评论 id 、作者或博客中的一个')
+    return conditions
+
+
+def stale_blogs(blog_ids):
+    page_cache.invalidate(*('blog:{}'.format(id) for id in blog_ids))
+
+
+def set_disabled(disable, ids=None, author_id=None, blog_id=None):
+    '''隐藏或恢复评论，返回状态发生变化的评论数量'''
+    conditions = criteria(ids, author_id, blog_id)
+    # 只更新状态需要改变的评论，其它评论的 updated_at 和 ETag 保持不变
+    if disable:
+        conditions.append(db.or_(Comment.disable.is_(None),
+                                 Comment.disable == False))
+    else:
+        conditions.append(Comment.disable == True)
+    blog_ids = [row.blog_id for row in db.session.query(Comment.blog_id)
+                .filter(*conditions).distinct()]
+    if not blog_ids:
+        return 0
+    count = (Comment.query.filter(*conditions)
+             .update({Comment.disable: disable,
+                      Comment.updated_at: datetime.now()},
+                     synchronize_session=False))
+    db.session.commit()
+    stale_blogs(blog_ids)
+    return count
+
+
+def purge(ids=None, author_id=None, blog_id=None, batch_size=None):
+    '''分批删除评论，返回删除的数量'''
+    conditions = criteria(ids, author_id, blog_id)
+    batch_size = batch_size or current_app.config['MODERATION_BATCH_SIZE']
+    total = 0
+    while True:
+        rows = (db.session.query(Comment.id, Comment.blog_id)
+                .filter(*conditions).order_by(Comment.id)
+                .limit(batch_size).all())
+        if not rows:
+            return total
+        batch = [row.id for row in rows]
+        Comment.query.filter(Comment.id.in_(batch)).delete(
+            synchronize_session=False)
+        search.remove_documents('c', batch)
+        db.session.commit()
+        stale_blogs({row.blog_id for row in rows})
+        total += len(batch)
+
+
+def apply(action, ids=None, author_id=None, blog_id=None):
+    '''执行 'disable'、'enable' 或 'purge' 操作，返回处理的评论数量'''
+    if action == 'disable':
+        return set_disabled(True, ids, author_id, blog_id)
+    if action == 'enable':
+        return set_disabled(False, ids, author_id, blog_id)
+    if action == 'purge':
+        return purge(ids, author_id, blog_id)
+    raise ValueError('未知的操作：{}'.format(action))
@@ -0,0 +1,214 @@
+'''
+未登录访客的整页缓存和片段缓存
+
+未登录访客看到的首页、博客页和用户主页完全相同，渲染结果按路由、
+页码和游标（即 request.full_path）缓存在内存中。
+每条缓存都带有标签，例如 'blogs'、'blog:3'、'user:5'，
+博客、评论（包括封禁状态）或作者资料被修改并提交后，
+对应标签下的缓存全部失效。
+'''
+import time
+from collections import OrderedDict
+from functools import wraps
+from threading import Lock
+
+from flask import g, request, session, current_app, make_response, render_template
+from flask_login import current_user
+from markupsafe import Markup
+from sqlalchemy.orm import object_session
+
+from models import db, User, Blog, Comment
+
+
+class PageCache:
+    '''按标签失效的 LRU 缓存，并统计命中和未命中的次数'''
+
+    def __init__(self, app=None):
+        self._data = OrderedDict()  # key -> (过期时间, 内容, 标签)
+        self._tags = {}             # 标签 -> key 的集合
+        self._lock = Lock()
+        self.maxsize = 500
+        self.ttl = 300
+        self.stats = {'page_hits': 0, 'page_misses': 0,
+                      'fragment_hits': 0, 'fragment_misses': 0}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('PAGE_CACHE_ENABLED', True)
+        app.config.setdefault('PAGE_CACHE_SIZE', 500)
+        app.config.setdefault('PAGE_CACHE_TTL', 300)
+        self.maxsize = app.config['PAGE_CACHE_SIZE']
+        self.ttl = app.config['PAGE_CACHE_TTL']
+        app.extensions['page_cache'] = self
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            if item[0] < time.monotonic():
+                self._remove(key)
+                return None
+            self._data.move_to_end(key)
+            return item[1]
+
+    def set(self, key, value, tags):
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = (time.monotonic() + self.ttl, value, tags)
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._data) > self.maxsize:
+                self._remove(next(iter(self._data)))
+
+    def _remove(self, key):
+        _, _, tags = self._data.pop(key)
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def invalidate(self, *tags):
+        '''删除带有任一标签的缓存'''
+        with self._lock:
+            for tag in tags:
+                for key in list(self._tags.get(tag, ())):
+                    self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._tags.clear()
+
+    # 以下方法在请求中使用
+
+    @staticmethod
+    def anonymous_get():
+        return (current_app.config['PAGE_CACHE_ENABLED'] and
+                request.method == 'GET' and current_user.is_anonymous)
+
+    @staticmethod
+    def tag(*tags):
+        '''为当前请求的页面添加标签'''
+        g.setdefault('page_cache_tags', set()).update(tags)
+
+    @staticmethod
+    def tag_blogs(blogs):
+        '''为页面中博客的作者添加标签，尚未渲染完成的博客不缓存'''
+        for blog in blogs:
+            PageCache.tag('user:{}'.format(blog.author_id))
+            if blog.body_html is None:
+                g.page_cache_skip = True
+
+    @staticmethod
+    def tag_comments(comments):
+        PageCache.tag(*('user:{}'.format(c.author_id) for c in comments))
+
+    def cached_page(self, view):
+        '''缓存未登录访客看到的整个页面的装饰器'''
+
+        @wraps(view)
+        def decorated_view(*args, **kw):
+            # 有 flash 消息的页面只显示一次，不能缓存
+            if not self.anonymous_get() or '_flashes' in session:
+                return view(*args, **kw)
+            key = 'page:' + request.full_path
+            html = self.get(key)
+            if html is not None:
+                self.stats['page_hits'] += 1
+                response = make_response(html)
+                response.headers['X-Cache'] = 'HIT'
+                return response
+            self.stats['page_misses'] += 1
+            response = make_response(view(*args, **kw))
+            if (response.status_code == 200 and not response.is_streamed
+                    and not g.get('page_cache_skip')):
+                self.set(key, response.get_data(),
+                         frozenset(g.get('page_cache_tags', ())))
+            response.headers['X-Cache'] = 'MISS'
+            return response
+
+        return decorated_view
+
+    def fragment(self, template, **context):
+        '''
+        渲染并缓存 _blogs.html 、_comments.html 等页面片段
+        只对未登录访客生效，其它情况返回 None ，由模板自行 include
+        '''
+        if not self.anonymous_get() or g.get('page_cache_skip'):
+            return None
+        key = 'fragment:{}:{}'.format(template, request.full_path)
+        html = self.get(key)
+        if html is None:
+            self.stats['fragment_misses'] += 1
+            html = render_template(template, **context)
+            self.set(key, html, frozenset(g.get('page_cache_tags', ())))
+        else:
+            self.stats['fragment_hits'] += 1
+        return Markup(html)
+
+
+page_cache = PageCache()
+
+
+# 数据修改后先记录需要失效的标签，事务提交后再删除缓存
+
+def stale(target, *tags):
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault('stale_pages', set()).update(tags)
+
+
+def modified(target):
+    # 添加评论等操作会令博客和作者实例也被标记为已修改，只有列的值变化时才算
+    session = object_session(target)
+    return session is not None and session.is_modified(
+        target, include_collections=False)
+
+
+def on_blog_changed(mapper, connection, target):
+    stale(target, 'blogs', 'blog:{}'.format(target.id),
+          'user:{}'.format(target.author_id))
+
+
+def on_blog_updated(mapper, connection, target):
+    if modified(target):
+        on_blog_changed(mapper, connection, target)
+
+
+def on_comment_changed(mapper, connection, target):
+    stale(target, 'blog:{}'.format(target.blog_id))
+
+
+def on_user_updated(mapper, connection, target):
+    if modified(target):
+        stale(target, 'user:{}'.format(target.id))
+
+
+def on_user_deleted(mapper, connection, target):
+    stale(target, 'blogs', 'user:{}'.format(target.id))
+
+
+def on_committed(session):
+    tags = session.info.pop('stale_pages', None)
+    if tags:
+        page_cache.invalidate(*tags)
+
+
+def on_rolled_back(session):
+    session.info.pop('stale_pages', None)
+
+
+db.event.listen(Blog, 'after_insert', on_blog_changed)
+db.event.listen(Blog, 'after_update', on_blog_updated)
+db.event.listen(Blog, 'after_delete', on_blog_changed)
+for event_name in ('after_insert', 'after_update', 'after_delete'):
+    db.event.listen(Comment, event_name, on_comment_changed)
+db.event.listen(User, 'after_update', on_user_updated)
+db.event.listen(User, 'after_delete', on_user_deleted)
+db.event.listen(db.session, 'after_commit', on_committed)
+db.event.listen(db.session, 'after_rollback', on_rolled_back)
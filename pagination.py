@@ -0,0 +1,142 @@
+'''
+基于游标（keyset）的分页
+
+Flask-SQLAlchemy 的 paginate 方法使用 OFFSET 跳过前面的数据，
+并且每次都要执行一次 COUNT(*) ，页码越大越慢。
+这里改用 (time_stamp, id) 作为游标，每一页都只需扫描 per_page + 1 条数据。
+'''
+import json
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+from datetime import datetime
+
+from flask import current_app, request
+from sqlalchemy import and_, or_, text
+
+from models import db
+
+
+def encode_cursor(direction, time_stamp, id):
+    '''生成不透明的游标字符串，direction 为 'n'（下一页）或 'p'（上一页）'''
+    data = json.dumps([direction, time_stamp.isoformat(), id])
+    return urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    '''解析游标字符串，格式不对时返回 None ，即从第一页开始'''
+    if not cursor:
+        return None
+    try:
+        padding = '=' * (-len(cursor) % 4)
+        direction, time_stamp, id = json.loads(
+            urlsafe_b64decode(cursor + padding).decode())
+        if direction not in ('n', 'p'):
+            return None
+        return direction, datetime.fromisoformat(time_stamp), int(id)
+    except (ValueError, TypeError):
+        return None
+
+
+def approximate_total(model):
+    '''估算数据表的总行数，代替精确的 COUNT(*)，不支持的数据库返回 None'''
+    if db.engine.dialect.name != 'mysql':
+        return None
+    return db.session.execute(text(
+        'SELECT table_rows FROM information_schema.tables '
+        'WHERE table_schema = DATABASE() AND table_name = :name'),
+        {'name': model.__tablename__}).scalar()
+
+
+class KeysetPagination:
+    '''游标分页的结果，接口尽量与 Flask-SQLAlchemy 的 Pagination 保持一致'''
+
+    keyset = True
+
+    def __init__(self, items, per_page, has_prev, has_next, columns,
+                 total=None):
+        self.items = items
+        self.per_page = per_page
+        self.has_prev = has_prev
+        self.has_next = has_next
+        self.total = total  # 近似总数，可能为 None
+        self._keys = [column.key for column in columns]
+
+    def _cursor(self, direction, item):
+        return encode_cursor(direction, *(getattr(item, key)
+                                          for key in self._keys))
+
+    @property
+    def next_cursor(self):
+        if self.has_next and self.items:
+            return self._cursor('n', self.items[-1])
+
+    @property
+    def prev_cursor(self):
+        if self.has_prev and self.items:
+            return self._cursor('p', self.items[0])
+
+
+def keyset_query(query, columns, position):
+    '''
+    按游标位置过滤并排序，position 为 decode_cursor 的返回值
+    benchmarks/query_plans.py 也用此函数生成要检查执行计划的查询
+    '''
+    time_column, id_column = columns
+    query = query.order_by(None)
+    if position is None or position[0] == 'n':
+        if position is not None:
+            _, time_stamp, id = position
+            query = query.filter(or_(time_column < time_stamp, and_(
+                time_column == time_stamp, id_column < id)))
+        return query.order_by(time_column.desc(), id_column.desc())
+    _, time_stamp, id = position
+    return query.filter(or_(time_column > time_stamp, and_(
+        time_column == time_stamp, id_column > id))).order_by(
+        time_column.asc(), id_column.asc())
+
+
+def keyset_paginate(query, columns, cursor=None, per_page=10, total=None,
+                    archive=None):
+    '''
+    按 columns 倒序（由新到旧）分页，columns 为 (时间列, 唯一列) 元组
+    cursor 为上一次分页结果中的 next_cursor 或 prev_cursor
+    archive 为归档表的 (query, columns)，两个表各取一页再合并，见 archive.py
+    '''
+    position = decode_cursor(cursor)
+    direction = position[0] if position else None
+    # 多取一条，用来判断是否还有更多数据
+    items = keyset_query(query, columns, position).limit(per_page + 1).all()
+    if archive is not None:
+        archive_query, archive_columns = archive
+        items += keyset_query(archive_query, archive_columns, position
+                              ).limit(per_page + 1).all()
+        keys = [column.key for column in columns]
+        items.sort(key=lambda item: [getattr(item, key) for key in keys],
+                   reverse=direction != 'p')
+        items = items[:per_page + 1]
+    more = len(items) > per_page
+    items = items[:per_page]
+    if direction == 'p':
+        items.reverse()
+        has_prev, has_next = more, True
+    else:
+        has_prev, has_next = direction == 'n', more
+    return KeysetPagination(items, per_page, has_prev, has_next, columns,
+                            total=total)
+
+
+def paginate(query, columns, per_page, total_of=None, archive=None):
+    '''
+    视图函数使用的分页入口，根据 PAGINATION_MODE 配置项选择分页方式
+    total_of 为数据表对应的映射类，仅在查询整张表时提供，用于估算总数
+    archive 为归档表的 (query, columns)，只有游标分页会合并归档表
+    '''
+    if current_app.config['PAGINATION_MODE'] == 'keyset':
+        total = None
+        if total_of is not None and current_app.config[
+                'PAGINATION_APPROXIMATE_TOTAL']:
+            total = approximate_total(total_of)
+        return keyset_paginate(query, columns, request.args.get('cursor'),
+                               per_page, total, archive)
+    page = request.args.get('page', 1, type=int)
+    return query.order_by(*(column.desc() for column in columns)).paginate(
+        page, per_page=per_page, error_out=False)
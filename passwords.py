@@ -0,0 +1,73 @@
+'''
+密码哈希服务
+
+密码哈希（PBKDF2 等）是 CPU 密集型计算，在请求线程中执行会长时间占用 GIL ，
+登录请求集中到来时所有工作线程都会被拖住。
+这里把计算交给有上限的进程池执行，请求线程只需等待结果。
+算法和迭代次数在 configs.py 中配置，用户登录成功时如果发现
+存储的哈希使用的是旧参数，就用新参数重新计算。
+'''
+import os
+from concurrent.futures import ProcessPoolExecutor
+from threading import Lock
+
+from flask import current_app, has_app_context
+from werkzeug.security import generate_password_hash, check_password_hash
+
+DEFAULTS = {
+    'PASSWORD_HASH_METHOD': 'pbkdf2:sha256:150000',
+    'PASSWORD_SALT_LENGTH': 16,
+    # 进程池大小，None 为 CPU 核数，0 表示在当前线程中计算
+    'PASSWORD_HASH_WORKERS': None,
+}
+
+
+def config(key):
+    if has_app_context():
+        return current_app.config.get(key, DEFAULTS[key])
+    return DEFAULTS[key]
+
+
+class PasswordHasher:
+    '''在进程池中计算和校验密码哈希'''
+
+    def __init__(self):
+        self._executor = None
+        self._lock = Lock()
+
+    @property
+    def executor(self):
+        workers = config('PASSWORD_HASH_WORKERS')
+        if workers == 0:
+            return None
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(workers or os.cpu_count())
+        return self._executor
+
+    def run(self, func, *args):
+        executor = self.executor
+        if executor is None:
+            return func(*args)
+        return executor.submit(func, *args).result()
+
+    def hash(self, password):
+        return self.run(generate_password_hash, password,
+                        config('PASSWORD_HASH_METHOD'),
+                        config('PASSWORD_SALT_LENGTH'))
+
+    def verify(self, hashed, password):
+        if not hashed:
+            return False
+        return self.run(check_password_hash, hashed, password)
+
+    def needs_rehash(self, hashed):
+        '''存储的哈希与当前配置的算法、迭代次数或盐的长度不一致'''
+        if not hashed or hashed.count('$') != 2:
+            return True
+        method, salt, _ = hashed.split('$')
+        return (method != config('PASSWORD_HASH_METHOD') or
+                len(salt) != config('PASSWORD_SALT_LENGTH'))
+
+
+hasher = PasswordHasher()
@@ -0,0 +1,55 @@
+'''
+统计每个请求执行的 SQL 语句数量
+
+配置项 MAX_QUERIES_PER_REQUEST 为每个请求允许执行的最大语句数，
+超出时在测试环境下抛出 QueryBudgetExceeded 异常令测试失败，
+其它环境下只记录一条警告日志。
+'''
+from flask import g, has_request_context, current_app, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+class QueryBudgetExceeded(AssertionError):
+    '''请求执行的 SQL 语句超出了预算'''
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def count_query(conn, cursor, statement, parameters, context, executemany):
+    # 只统计请求上下文中执行的语句，后台线程和命令行不计入
+    if has_request_context():
+        g.query_count = g.get('query_count', 0) + 1
+        statements = g.setdefault('query_statements', [])
+        if len(statements) < 100:
+            statements.append(statement)
+
+
+def query_count():
+    '''当前请求已执行的 SQL 语句数量'''
+    return g.get('query_count', 0)
+
+
+class QueryGuard:
+    '''检查每个请求的 SQL 语句数量是否超出预算的扩展'''
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('MAX_QUERIES_PER_REQUEST', None)
+        app.extensions['query_guard'] = self
+        app.after_request(self.check)
+
+    def check(self, response):
+        limit = current_app.config['MAX_QUERIES_PER_REQUEST']
+        count = query_count()
+        if limit is None or count <= limit:
+            return response
+        message = '{} issued {} queries (limit {}):\n{}'.format(
+            request.endpoint, count, limit,
+            '\n'.join(g.get('query_statements', [])))
+        if current_app.testing:
+            raise QueryBudgetExceeded(message)
+        current_app.logger.warning(message)
+        return response
@@ -0,0 +1,129 @@
+'''
+按 IP 和用户限制请求频率（令牌桶算法）
+
+RATE_LIMITS 配置项为 {视图函数: [规则, ...]}，每条规则为
+(按 'ip' 或 'user' 计数, 次数, 秒数[, 请求方法元组])，请求方法默认为 ('POST',)。
+例如 ('ip', 10, 60) 表示同一个 IP 每 60 秒最多 10 次，可以短时间内连续请求 10 次，
+之后每 6 秒恢复一次。'user' 按登录用户计数，未登录时按 IP 计数。
+超过限制时返回 429 ，检查在 before_request 中完成，不会查询数据库。
+部署在反向代理后面时必须设置 TRUSTED_PROXIES ，否则所有访客的 IP 都是代理的地址。
+
+默认每个进程在内存中保存计数，每个 key 只占 (剩余次数, 时间) 两个数，
+最多保存 RATE_LIMIT_MAX_KEYS 个，超过时淘汰最久没有请求的。
+多个进程或多台服务器需要共享计数时，把 RATE_LIMIT_STORAGE_URL 设为 Redis 地址，
+需要安装 redis 包。
+'''
+import math
+import time
+from collections import OrderedDict
+from threading import Lock
+
+from flask import request, session, current_app
+from werkzeug.exceptions import TooManyRequests
+
+
+class MemoryStore:
+    '''进程内的令牌桶，按最近使用的顺序淘汰'''
+
+    def __init__(self, max_keys):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()  # key -> (剩余次数, 更新时间)
+        self._lock = Lock()
+
+    def consume(self, key, capacity, rate):
+        '''消耗一次，返回 (是否允许, 需要等待的秒数)'''
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            # 被淘汰的 key 相当于桶是满的，只会让限制略微放宽
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return allowed, 0 if allowed else (1 - tokens) / rate
+
+
+class RedisStore:
+    '''多个进程共享的令牌桶，用 Lua 脚本保证原子性'''
+
+    SCRIPT = '''
+    local capacity = tonumber(ARGV[1])
+    local rate = tonumber(ARGV[2])
+    local now = tonumber(ARGV[3])
+    local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+    local tokens = tonumber(bucket[1]) or capacity
+    local updated = tonumber(bucket[2]) or now
+    tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+    local allowed = 0
+    if tokens >= 1 then
+        tokens = tokens - 1
+        allowed = 1
+    end
+    redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+    redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+    return {allowed, tostring(tokens)}
+    '''
+
+    def __init__(self, url):
+        import redis
+        self._script = redis.Redis.from_url(url).register_script(self.SCRIPT)
+
+    def consume(self, key, capacity, rate):
+        allowed, tokens = self._script(
+            keys=['ratelimit:' + key], args=[capacity, rate, time.time()])
+        if allowed:
+            return True, 0
+        return False, (1 - float(tokens)) / rate
+
+
+class RateLimiter:
+    '''在视图函数执行前检查 RATE_LIMITS 中配置的限制'''
+
+    def __init__(self, app=None):
+        self.store = None
+        self.stats = {'limited': 0}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('RATE_LIMIT_ENABLED', True)
+        app.config.setdefault('RATE_LIMITS', {})
+        app.config.setdefault('RATE_LIMIT_MAX_KEYS', 100000)
+        app.config.setdefault('RATE_LIMIT_STORAGE_URL', None)
+        app.extensions['rate_limiter'] = self
+        if app.config['RATE_LIMIT_STORAGE_URL']:
+            self.store = RedisStore(app.config['RATE_LIMIT_STORAGE_URL'])
+        else:
+            self.store = MemoryStore(app.config['RATE_LIMIT_MAX_KEYS'])
+        app.before_request(self.check)
+
+    @staticmethod
+    def identity(by):
+        # 直接读取 session cookie 中的用户 id ，不需要加载用户
+        if by == 'user' and session.get('_user_id'):
+            return 'user:' + session['_user_id']
+        return 'ip:' + (request.remote_addr or '')
+
+    def check(self):
+        if not current_app.config['RATE_LIMIT_ENABLED']:
+            return
+        rules = current_app.config['RATE_LIMITS'].get(request.endpoint)
+        if not rules:
+            return
+        for rule in rules:
+            by, limit, period = rule[:3]
+            methods = rule[3] if len(rule) > 3 else ('POST',)
+            if request.method not in methods:
+                continue
+            key = '{}:{}:{}:{}'.format(request.endpoint, limit, period,
+                                       self.identity(by))
+            allowed, retry_after = self.store.consume(key, limit,
+                                                      limit / period)
+            if not allowed:
+                self.stats['limited'] += 1
+                error = TooManyRequests()
+                error.retry_after = int(math.ceil(retry_after))
+                raise error
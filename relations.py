@@ -0,0 +1,57 @@
+'''
+已登录用户与其他用户之间的关注关系
+
+用户主页和关注列表需要知道当前用户是否关注了页面中的每个用户、是否被他们关注。
+resolve 用一条查询得到当前用户与一组用户之间的双向关系，
+结果保存在 flask.g 中，同一个请求内再次查询同一个用户时不会访问数据库。
+'''
+from collections import namedtuple
+
+from flask import g
+
+from models import db, Follow
+
+
+class Relation(namedtuple('Relation', 'following followed_by')):
+    '''following：当前用户关注了对方；followed_by：对方关注了当前用户'''
+
+    @property
+    def mutual(self):
+        return self.following and self.followed_by
+
+
+NONE = Relation(False, False)
+
+
+def resolve(viewer, users):
+    '''返回 {用户 id: Relation}，未登录时所有关系都为 False'''
+    if not getattr(viewer, 'is_authenticated', False):
+        return {user.id: NONE for user in users}
+    cache = g.setdefault('relations', {}).setdefault(viewer.id, {})
+    missing = {user.id for user in users} - set(cache) - {viewer.id}
+    if missing:
+        following, followed_by = set(), set()
+        rows = (db.session.query(Follow.follower_id, Follow.followed_id)
+                .filter(db.or_(
+                    db.and_(Follow.follower_id == viewer.id,
+                            Follow.followed_id.in_(missing)),
+                    db.and_(Follow.followed_id == viewer.id,
+                            Follow.follower_id.in_(missing)))))
+        for follower_id, followed_id in rows:
+            if follower_id == viewer.id:
+                following.add(followed_id)
+            else:
+                followed_by.add(follower_id)
+        for id in missing:
+            cache[id] = Relation(id in following, id in followed_by)
+    return {user.id: cache.get(user.id, NONE) for user in users}
+
+
+def relation(viewer, user):
+    '''当前用户与一个用户之间的关系'''
+    return resolve(viewer, [user])[user.id]
+
+
+def forget(viewer):
+    '''关注或取关之后，丢弃本次请求中已经查询到的关系'''
+    g.get('relations', {}).pop(getattr(viewer, 'id', None), None)
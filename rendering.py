@@ -0,0 +1,104 @@
+'''
+博客 Markdown 的渲染与缓存
+
+渲染结果以「正文 + 清洗规则」的哈希值为键缓存，内容相同的博客不会重复渲染。
+清洗规则（允许的标签等）变化后哈希值随之变化，旧的缓存自然失效。
+较长的博客交给后台线程渲染，请求可以立即返回。
+'''
+import hashlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+import bleach
+import markdown as markdown_module
+from markdown import markdown
+
+ALLOWED_TAGS = ['a', 'abbr', 'acronym', 'b', 'blockquote', 'code',
+                'em', 'i', 'li', 'ol', 'pre', 'strong', 'ul',
+                'h1', 'h2', 'h3', 'p']
+
+# 清洗规则的指纹，规则或依赖库版本变化时渲染结果可能不同
+POLICY = '|'.join(['tags=' + ','.join(sorted(ALLOWED_TAGS)), 'strip=1',
+                   'markdown=' + markdown_module.__version__,
+                   'bleach=' + bleach.__version__])
+
+
+def content_key(body):
+    '''正文与清洗规则共同决定的缓存键'''
+    return hashlib.sha256((POLICY + '\0' + body).encode()).hexdigest()
+
+
+class RenderCache:
+    '''线程安全的 LRU 缓存，容量满了之后淘汰最久未使用的条目'''
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key):
+        with self._lock:
+            html = self._data.get(key)
+            if html is not None:
+                self._data.move_to_end(key)
+            return html
+
+    def set(self, key, html):
+        with self._lock:
+            self._data[key] = html
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def __contains__(self, key):
+        return key in self._data
+
+
+render_cache = RenderCache()
+
+
+def render_markdown(body):
+    '''把 Markdown 正文渲染为清洗过的 HTML ，相同内容直接读取缓存'''
+    key = content_key(body)
+    html = render_cache.get(key)
+    if html is None:
+        # bleach.linkify 方法将 <a> 标签转换为链接
+        # bleach.clean 方法清洗 HTML 数据
+        # markdown 方法将 Markdown 文本转换为 HTML
+        html = bleach.linkify(bleach.clean(markdown(body, output_format='html'),
+                                           tags=ALLOWED_TAGS, strip=True))
+        render_cache.set(key, html)
+    return html
+
+
+def is_cached(body):
+    return content_key(body) in render_cache
+
+
+class BackgroundRenderer:
+    '''在后台线程池中执行渲染任务，线程池在第一次提交任务时创建'''
+
+    def __init__(self, max_workers=2):
+        self.max_workers = max_workers
+        self._executor = None
+        self._lock = Lock()
+
+    def submit(self, func, *args):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    self.max_workers, thread_name_prefix='render')
+        return self._executor.submit(func, *args)
+
+
+background_renderer = BackgroundRenderer()
+
+
+def init_rendering(app):
+    '''根据配置设置缓存容量和后台渲染线程数'''
+    app.config.setdefault('RENDER_CACHE_SIZE', 1024)
+    app.config.setdefault('RENDER_WORKERS', 2)
+    app.config.setdefault('RENDER_ASYNC_THRESHOLD', None)
+    render_cache.maxsize = app.config['RENDER_CACHE_SIZE']
+    background_renderer.max_workers = app.config['RENDER_WORKERS']
@@ -0,0 +1,122 @@
+'''
+读写分离：GET 请求中的查询发送到只读副本，写操作总是发送到主库
+
+副本在 SQLALCHEMY_BINDS 中配置，SQLALCHEMY_REPLICAS 列出其中哪些是副本，
+每个请求随机选择一个副本并在整个请求中使用它。
+以下情况查询发送到主库：
+    非 GET / HEAD / OPTIONS 请求，以及没有请求上下文的后台线程和命令行
+    同一个请求中已经写过数据库（flush 或 INSERT / UPDATE / DELETE 语句）
+    SELECT ... FOR UPDATE 和不是查询的原始 SQL 文本
+    设置了 execution_options(use_primary=True) 的查询
+    用 primary_required 装饰的视图函数，例如会写数据库的 GET 请求（关注、取关），
+    写之前的读取也要在主库上进行，不能根据副本上延迟的数据做判断
+    用户写入数据后的 REPLICA_STICKY_SECONDS 秒内（记录在 session cookie 中），
+    保证用户发布博客或评论后跳转回来的页面能看到自己刚写入的数据
+
+本地测试可以用两个 SQLite 文件，例如：
+    SQLALCHEMY_DATABASE_URI = 'sqlite:///primary.db'
+    SQLALCHEMY_BINDS = {'replica': 'sqlite:///replica.db'}
+    SQLALCHEMY_REPLICAS = ['replica']
+'''
+import random
+import re
+import time
+from functools import wraps
+
+from flask import g, request, session as cookie_session, has_request_context
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import orm
+from sqlalchemy.sql.dml import UpdateBase
+from sqlalchemy.sql.elements import TextClause
+
+READ_METHODS = ('GET', 'HEAD', 'OPTIONS')
+# session cookie 中记录的到期时间，到期前该用户的查询都发送到主库
+STICKY_KEY = '_primary_until'
+# 只读的原始 SQL 文本，例如 information_schema 查询
+READ_TEXT = re.compile(r'^\s*(SELECT|WITH|SHOW|EXPLAIN|DESCRIBE)\b', re.I)
+LOCKING_TEXT = re.compile(r'\bFOR\s+(UPDATE|SHARE)\b|\bLOCK\s+IN\b', re.I)
+
+
+def mark_write():
+    '''当前请求写过数据库，之后的查询都发送到主库'''
+    if has_request_context():
+        g.db_wrote = True
+
+
+def primary_required(view):
+    '''视图函数中的所有查询都发送到主库'''
+
+    @wraps(view)
+    def decorated_view(*args, **kw):
+        g.db_primary = True
+        return view(*args, **kw)
+
+    return decorated_view
+
+
+def is_write(clause):
+    '''clause 是否必须在主库上执行'''
+    if isinstance(clause, UpdateBase):
+        return True
+    if isinstance(clause, TextClause):
+        return (not READ_TEXT.match(clause.text) or
+                LOCKING_TEXT.search(clause.text) is not None)
+    return getattr(clause, '_for_update_arg', None) is not None
+
+
+def choose_replica(app):
+    '''返回当前请求使用的副本名称，应该使用主库时返回 None'''
+    replicas = app.config['SQLALCHEMY_REPLICAS']
+    if not replicas or not has_request_context():
+        return None
+    if (request.method not in READ_METHODS or g.get('db_wrote') or
+            g.get('db_primary')):
+        return None
+    if cookie_session.get(STICKY_KEY, 0) > time.time():
+        return None
+    if 'db_replica' not in g:
+        g.db_replica = random.choice(replicas)
+    return g.db_replica
+
+
+class RoutingSession(SignallingSession):
+    '''根据请求类型选择主库或副本的 session'''
+
+    def __init__(self, db, **options):
+        self._db = db
+        super().__init__(db, **options)
+
+    def get_bind(self, mapper=None, clause=None):
+        # 设置了 __bind_key__ 的模型仍然使用自己的数据库
+        if mapper is not None and mapper.persist_selectable.info.get(
+                'bind_key') is not None:
+            return super().get_bind(mapper, clause)
+        if self._flushing or is_write(clause):
+            mark_write()
+            return super().get_bind(mapper, clause)
+        if getattr(clause, '_execution_options', {}).get('use_primary'):
+            return super().get_bind(mapper, clause)
+        replica = choose_replica(self.app)
+        if replica is None:
+            return super().get_bind(mapper, clause)
+        return self._db.get_engine(self.app, bind=replica)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    '''使用 RoutingSession 的 SQLAlchemy 扩展'''
+
+    def init_app(self, app):
+        app.config.setdefault('SQLALCHEMY_REPLICAS', [])
+        app.config.setdefault('REPLICA_STICKY_SECONDS', 5)
+        super().init_app(app)
+
+        @app.after_request
+        def stick_to_primary(response):
+            if app.config['SQLALCHEMY_REPLICAS'] and (
+                    request.method not in READ_METHODS or g.get('db_wrote')):
+                cookie_session[STICKY_KEY] = (
+                    time.time() + app.config['REPLICA_STICKY_SECONDS'])
+            return response
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
@@ -0,0 +1,150 @@
+'''
+博客和评论的全文搜索
+
+倒排索引存储在 search_postings 数据表中。
+分词规则：英文和数字按单词切分并转为小写，中日韩文字按相邻两字（bigram）切分，
+单独的一个汉字作为一个词项。查询语句使用同样的规则分词。
+Blog.body 或 Comment.body 被修改时（与 Blog.on_changed_body 相同的 'set' 事件），
+在同一个事务中更新该文档的索引，也可以用 flask rebuild-search-index 命令重建。
+'''
+import math
+import re
+from collections import Counter
+
+from sqlalchemy import func, case
+from sqlalchemy.orm import object_session
+
+from models import db, Blog, Comment, SearchPosting
+
+# 中日韩文字（汉字、假名、谚文）和英文、数字
+CJK = '぀-ヿ㐀-䶿一-鿿豈-﫿가-힯'
+TOKEN_RE = re.compile('([{}]+)|([a-z0-9]+)'.format(CJK))
+MAX_TERM_LENGTH = 64
+
+DOC_TYPES = {Blog: 'b', Comment: 'c'}
+
+
+def tokenize(text):
+    '''把文本切分为词项，返回 {词项: 出现次数}'''
+    terms = Counter()
+    for cjk, word in TOKEN_RE.findall((text or '').lower()):
+        if cjk:
+            if len(cjk) == 1:
+                terms[cjk] += 1
+            for i in range(len(cjk) - 1):
+                terms[cjk[i:i + 2]] += 1
+        elif len(word) > 1 or word.isdigit():
+            terms[word[:MAX_TERM_LENGTH]] += 1
+    return terms
+
+
+def postings(doc_type, doc_id, text):
+    return [dict(term=term, doc_type=doc_type, doc_id=doc_id, tf=tf)
+            for term, tf in tokenize(text).items()]
+
+
+def index_document(connection, doc_type, doc_id, text):
+    '''删除文档原有的索引，再写入新的索引'''
+    table = SearchPosting.__table__
+    connection.execute(table.delete().where(table.c.doc_type == doc_type)
+                       .where(table.c.doc_id == doc_id))
+    rows = postings(doc_type, doc_id, text)
+    if rows:
+        connection.execute(table.insert(), rows)
+
+
+def remove_documents(doc_type, doc_ids):
+    '''从索引中删除文档，用于批量删除博客或评论之后'''
+    SearchPosting.query.filter(SearchPosting.doc_type == doc_type,
+                               SearchPosting.doc_id.in_(doc_ids)
+                               ).delete(synchronize_session=False)
+
+
+def search(query, limit=20, offset=0):
+    '''
+    搜索博客和评论，返回按相关度排序的 (doc_type, doc_id) 列表
+    命中的词项越多越靠前，其次按 BM25 的 idf 和词频打分
+    '''
+    terms = list(tokenize(query))
+    if not terms:
+        return []
+    df = dict(db.session.query(SearchPosting.term, func.count())
+              .filter(SearchPosting.term.in_(terms))
+              .group_by(SearchPosting.term))
+    if not df:
+        return []
+    # 用最大 id 估算文档总数，避免 COUNT(*)
+    total = ((db.session.query(func.max(Blog.id)).scalar() or 0) +
+             (db.session.query(func.max(Comment.id)).scalar() or 0))
+    idf = {term: math.log(1 + (total - n + 0.5) / (n + 0.5))
+           for term, n in df.items()}
+    weight = case([(SearchPosting.term == term, value)
+                   for term, value in idf.items()], else_=0)
+    tf = SearchPosting.tf * 2.2 / (SearchPosting.tf + 1.2)
+    matched = func.count(SearchPosting.term)
+    score = func.sum(weight * tf)
+    # 在分页之前排除被封禁的评论，每页的数量和是否有下一页才准确
+    disabled = db.exists().where(db.and_(Comment.id == SearchPosting.doc_id,
+                                         Comment.disable == True))
+    rows = (db.session.query(SearchPosting.doc_type, SearchPosting.doc_id)
+            .filter(SearchPosting.term.in_(list(df)))
+            .filter(db.or_(SearchPosting.doc_type != 'c', ~disabled))
+            .group_by(SearchPosting.doc_type, SearchPosting.doc_id)
+            .order_by(matched.desc(), score.desc(), SearchPosting.doc_id.desc())
+            .limit(limit).offset(offset))
+    return [(row.doc_type, row.doc_id) for row in rows]
+
+
+def load_results(hits):
+    '''
+    按搜索结果的顺序加载博客和评论
+    search 已经排除了被封禁的评论，这里再过滤一次，以防查询之间评论被封禁
+    '''
+    blog_ids = [doc_id for doc_type, doc_id in hits if doc_type == 'b']
+    comment_ids = [doc_id for doc_type, doc_id in hits if doc_type == 'c']
+    blogs = {blog.id: blog for blog in Blog.with_authors(Blog.query)
+             .filter(Blog.id.in_(blog_ids))} if blog_ids else {}
+    comments = {comment.id: comment for comment in
+                Comment.with_authors(Comment.query)
+                .filter(Comment.id.in_(comment_ids))
+                .filter(db.or_(Comment.disable.is_(None), Comment.disable == False))
+                } if comment_ids else {}
+    return ([blogs[i] for i in blog_ids if i in blogs],
+            [comments[i] for i in comment_ids if i in comments])
+
+
+# 与 Blog.on_changed_body 一样监听 body 的 'set' 事件
+# 此时新文档还没有 id ，先做标记，写入数据库后再更新索引
+
+def on_changed_body(target, value, old_value, initiator):
+    if value != old_value:
+        target._reindex = True
+
+
+def on_flushed(mapper, connection, target):
+    if getattr(target, '_reindex', False):
+        del target._reindex
+        index_document(connection, DOC_TYPES[mapper.class_], target.id,
+                       target.body)
+
+
+def on_deleted(mapper, connection, target):
+    table = SearchPosting.__table__
+    connection.execute(table.delete()
+                       .where(table.c.doc_type == DOC_TYPES[mapper.class_])
+                       .where(table.c.doc_id == target.id))
+
+
+for model in DOC_TYPES:
+    db.event.listen(model.body, 'set', on_changed_body)
+    db.event.listen(model, 'after_insert', on_flushed)
+    db.event.listen(model, 'after_update', on_flushed)
+    db.event.listen(model, 'after_delete', on_deleted)
+
+
+def tokenize_rows(rows):
+    '''在子进程中为一批 (doc_type, doc_id, text) 生成索引数据'''
+    result = []
+    for doc_type, doc_id, text in rows:
+        result.extend(postings(doc_type, doc_id, text))
+    return result
@@ -0,0 +1,136 @@
+'''
+“可能认识的人”：推荐用户关注的人所关注的人（二度关系）
+
+由 flask suggest-follows 命令离线计算。先把 follows 数据表按
+(follower_id, followed_id) 的顺序读入内存，保存为压缩稀疏行（CSR）格式：
+ids 是排好序的用户 id ，用户在 ids 中的下标为 i 时，
+该用户关注的用户的下标是 targets[offsets[i]:offsets[i + 1]] 。
+三个都是 array ，每个用户或每条关注只占一个整数，一百万条关注约 8 MB 。
+
+用户 u 的推荐：对 u 关注的每个用户 v ，给 v 关注的每个用户 w 加一分，
+去掉 u 自己和 u 已经关注的人，取分数最高的 SUGGESTIONS_PER_USER 个。
+
+默认只重新计算有变化的用户：关注和取关时 Follow 的事件把关注者写入
+suggestion_stale（见 Suggestion.mark_stale ），计算时再加上关注者的粉丝，
+因为粉丝的二度关系也变了；被关注的人关注的用户没有变，不需要重新计算。
+--full 重新计算所有用户。
+'''
+import heapq
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from datetime import datetime
+
+from flask import current_app
+
+from models import db, User, Follow, Suggestion, StaleSuggestion
+from dataio import iter_rows, chunked
+
+
+class FollowGraph:
+    '''只读的关注关系图，用户用 ids 中的下标表示'''
+
+    def __init__(self, ids, offsets, targets):
+        self.ids = ids
+        self.offsets = offsets
+        self.targets = targets
+
+    @classmethod
+    def load(cls, chunk_size=10000):
+        '''按主键顺序分块读取 follows 数据表，构建 CSR 数组'''
+        ids = array('q', sorted(
+            row.id for row in db.session.query(User.id).yield_per(chunk_size)))
+        counts = array('q', [0]) * len(ids)
+        targets = array('q')
+        for row in iter_rows(Follow.__table__, chunk_size):
+            follower = cls._find(ids, row.follower_id)
+            followed = cls._find(ids, row.followed_id)
+            if follower is None or followed is None:
+                continue
+            # 数据按 follower_id 排序，同一个用户关注的人在 targets 中是连续的
+            counts[follower] += 1
+            targets.append(followed)
+        offsets = array('q', [0])
+        for count in counts:
+            offsets.append(offsets[-1] + count)
+        return cls(ids, offsets, targets)
+
+    @staticmethod
+    def _find(ids, user_id):
+        i = bisect_left(ids, user_id)
+        return i if i < len(ids) and ids[i] == user_id else None
+
+    def index(self, user_id):
+        return self._find(self.ids, user_id)
+
+    def followed(self, i):
+        return self.targets[self.offsets[i]:self.offsets[i + 1]]
+
+    def with_followers(self, user_ids):
+        '''user_ids 加上他们的粉丝，扫描一遍 targets'''
+        marked = {self.index(user_id) for user_id in user_ids} - {None}
+        result = set(user_ids)
+        for i in range(len(self.ids)):
+            if any(j in marked for j in self.followed(i)):
+                result.add(self.ids[i])
+        return sorted(result)
+
+    def suggest(self, user_id, top):
+        '''返回 [(推荐的用户 id, 分数)]，分数相同时 id 小的在前'''
+        i = self.index(user_id)
+        if i is None:
+            return []
+        followed = self.followed(i)
+        scores = Counter()
+        for j in followed:
+            scores.update(self.followed(j))
+        for j in followed:
+            scores.pop(j, None)
+        scores.pop(i, None)
+        best = heapq.nsmallest(top, scores.items(),
+                               key=lambda item: (-item[1], item[0]))
+        return [(self.ids[j], score) for j, score in best]
+
+
+def write(graph, user_ids, top):
+    '''替换 user_ids 中每个用户的推荐，不提交'''
+    now = datetime.now()
+    rows = [dict(user_id=user_id, suggested_id=suggested_id, score=score,
+                 computed_at=now)
+            for user_id in user_ids
+            for suggested_id, score in graph.suggest(user_id, top)]
+    Suggestion.query.filter(Suggestion.user_id.in_(user_ids)).delete(
+        synchronize_session=False)
+    if rows:
+        db.session.execute(Suggestion.__table__.insert(), rows)
+
+
+def refresh(full=False, top=None, batch_size=None):
+    '''
+    重新计算推荐，每批完成后返回本批的用户数量
+    计算期间新标记的用户留到下一次，不会被误删
+    '''
+    config = current_app.config
+    top = top or config['SUGGESTIONS_PER_USER']
+    batch_size = batch_size or config['SUGGESTIONS_BATCH_SIZE']
+    last_mark = db.session.query(db.func.max(StaleSuggestion.id)).scalar()
+    if full:
+        user_ids = [row.id for row in db.session.query(User.id)]
+    elif last_mark is None:
+        return
+    else:
+        user_ids = [row.user_id for row in
+                    db.session.query(StaleSuggestion.user_id)
+                    .filter(StaleSuggestion.id <= last_mark).distinct()]
+    graph = FollowGraph.load()
+    if not full:
+        user_ids = graph.with_followers(user_ids)
+    for batch in chunked(user_ids, batch_size):
+        write(graph, batch, top)
+        db.session.commit()
+        yield len(batch)
+    if last_mark is not None:
+        # 全部计算完成后才删除标记，中途失败时下次会重新计算
+        StaleSuggestion.query.filter(StaleSuggestion.id <= last_mark).delete(
+            synchronize_session=False)
+        db.session.commit()
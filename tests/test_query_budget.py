@@ -0,0 +1,79 @@
+'''
+主要页面的 SQL 语句数量不超过 TestConfig.MAX_QUERIES_PER_REQUEST
+
+    python -m pytest tests
+'''
+import os
+import tempfile
+import unittest
+
+from sqlalchemy import event
+
+from app import create_app
+from models import db
+from benchmarks.seed import seed, PASSWORD
+
+
+class QueryBudgetTest(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        self.app = create_app('test')
+        # 关闭页面缓存，每个请求都真正查询数据库
+        self.app.config.update(
+            SQLALCHEMY_DATABASE_URI='sqlite:///' + self.path,
+            SECRET_KEY='test', WTF_CSRF_ENABLED=False,
+            MAIL_SUPPRESS_SEND=True, PAGE_CACHE_ENABLED=False)
+        self.budget = self.app.config['MAX_QUERIES_PER_REQUEST']
+        with self.app.app_context():
+            # 多个作者，每篇博客都有评论，作者之间互相关注
+            seed(users=12, follows=4, blogs=60, comments=240)
+            self.engine = db.engine
+        self.statements = []
+        event.listen(self.engine, 'before_cursor_execute', self.count)
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        event.remove(self.engine, 'before_cursor_execute', self.count)
+        # 删除数据库之前写入内存中的活跃时间，进程退出时就没有要写的了
+        self.app.extensions['last_seen'].stop()
+        with self.app.app_context():
+            db.session.remove()
+            db.engine.dispose()
+        os.remove(self.path)
+
+    def count(self, conn, cursor, statement, *args):
+        self.statements.append(statement)
+
+    def get(self, url):
+        '''请求页面，包括流式输出的部分在内检查语句数量'''
+        self.statements = []
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, url)
+        response.get_data()
+        self.assertLessEqual(len(self.statements), self.budget,
+                             '{}:\n{}'.format(url, '\n'.join(self.statements)))
+        return response
+
+    def check_pages(self):
+        self.get('/')
+        self.get('/?page=2')
+        for id in (1, 30, 60):
+            self.get('/blog/{}'.format(id))
+        for i in (1, 2, 12):
+            self.get('/user/user{}/index'.format(i))
+            self.get('/user/user{}/index?stream=1'.format(i))
+
+    def test_anonymous(self):
+        self.check_pages()
+
+    def test_logged_in(self):
+        response = self.client.post('/login', data=dict(
+            email='user1@example.com', password=PASSWORD))
+        self.assertEqual(response.status_code, 302)
+        self.check_pages()
+
+
+if __name__ == '__main__':
+    unittest.main()